@@ -0,0 +1,59 @@
+"""
+Cold import time of the main entry points of syntax, each measured in fresh interpreters.
+
+Fails (exit code 1) if importing an entry point loads a heavy dependency it must not load
+(matplotlib, scikit-image, scipy or pandas, which are imported lazily when needed) or if its best
+import time is above the budget, so it can guard against import time regressions in CI.
+
+    PYTHONPATH=. python benchmarks/import_time.py --repeats 5 --budget 1.0
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ENTRY_POINTS = ['syntax.slide', 'syntax.transformers', 'syntax.transformers.tiling']
+HEAVY_MODULES = ['matplotlib', 'skimage', 'scipy', 'pandas']
+
+CHILD = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, repeats):
+    """Best import time of module in fresh interpreters and the heavy modules it loaded."""
+    best, loaded = float('inf'), []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', CHILD.format(module=module, heavy=HEAVY_MODULES)],
+                                check=True, capture_output=True, text=True, env=dict(os.environ))
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        best, loaded = min(best, result['seconds']), result['loaded']
+    return best, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help='maximum import time in seconds')
+    args = parser.parse_args()
+
+    failed = False
+    for module in ENTRY_POINTS:
+        seconds, loaded = measure(module, args.repeats)
+        problems = []
+        if loaded:
+            problems.append('loads {}'.format(', '.join(loaded)))
+        if seconds > args.budget:
+            problems.append('over budget of {:.2f}s'.format(args.budget))
+        failed = failed or bool(problems)
+        print('{:<30} {:6.3f}s  {}'.format(module, seconds, '; '.join(problems) or 'ok'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Speed and quality of the tile resampling filters of Slide.get_tile on a synthetic slide.
+
+Tiles are read at magnifications below the slide levels so they are resized from the 10x level:
+an integer downsample (5x) and a non-integer one (8x). Quality is the PSNR against a ground truth
+computed from the higher resolution level 0, which the tiles never see: the exact area average of
+the level 0 region in floating point, i.e. what a scanner imaging at the target magnification
+integrates over each pixel. Magnifications read from level 0 itself are left out, as the area
+average of their extraction region would favour the box filter by construction. The most
+accurate filter also depends on how the slide's pyramid levels were made, the synthetic levels
+are plain subsamples of level 0.
+
+Fails (exit code 1) if a filter's PSNR falls below its floor in PSNR_FLOORS, set about 1 dB under
+the PSNR measured on the synthetic slide, or if the box fast path of integer downsamples
+(Image.reduce) differs from Image.resize with the box filter by more than 1 at any pixel.
+
+    PYTHONPATH=. python benchmarks/resample.py --size 8192 --tiles 300
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import write_synthetic_slide
+from syntax.slide import Slide
+from syntax.slide.slide import RESAMPLE_FILTERS
+
+TILE_SIZE = 256
+
+# Minimum mean PSNR in dB of each filter per magnification, on the synthetic slide.
+PSNR_FLOORS = {8: {'box': 31.0, 'nearest': 29.5, 'bilinear': 35.5, 'bicubic': 33.5, 'lanczos': 33.0,
+                   'thumbnail': 33.5},
+               5: {'box': 36.0, 'nearest': 30.0, 'bilinear': 38.5, 'bicubic': 37.5, 'lanczos': 37.0,
+                   'thumbnail': 37.5}}
+
+
+def area_average(region, size):
+    """Exact area average of an RGB region to size x size, in floating point."""
+    channels = [np.asarray(Image.fromarray(region[:, :, c].astype(np.float32), mode='F').resize((size, size),
+                                                                                               Image.BOX))
+                for c in range(3)]
+    return np.stack(channels, axis=2)
+
+
+def psnr(tile, reference):
+    mse = np.mean((tile.astype(np.float64) - reference) ** 2)
+    return 10 * np.log10(255 ** 2 / mse) if mse > 0 else np.inf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=8192)
+    parser.add_argument('--tiles', type=int, default=300)
+    parser.add_argument('--slide-dir', default=os.path.join(tempfile.gettempdir(), 'syntax-benchmark-slides'))
+    args = parser.parse_args()
+
+    path = os.path.join(args.slide_dir, 'synthetic_{}_50.tif'.format(args.size))
+    if not os.path.exists(path):
+        os.makedirs(args.slide_dir, exist_ok=True)
+        write_synthetic_slide(path + '.tmp.tif', args.size, 0.5)
+        os.replace(path + '.tmp.tif', path)
+    slide = Slide(path, level0=40)
+    rng = np.random.default_rng(0)
+
+    failed = False
+    for magnification in [8, 5]:
+        level, extraction_size, factor = slide._plan(magnification, TILE_SIZE)
+        assert level > 0, 'The ground truth must come from a higher resolution than the tiles.'
+        extent = int(round(TILE_SIZE * slide.level0 / magnification))  # Tile extent at level 0.
+        coordinates = (rng.integers(0, (args.size - extent) // 64, (args.tiles, 2)) * 64).tolist()
+        regions = [np.asarray(slide.read_region((w, h), level, (extraction_size, extraction_size)).convert('RGB'))
+                   for w, h in coordinates]
+        references = [area_average(np.asarray(slide.read_region((w, h), 0, (extent, extent)).convert('RGB')),
+                                   TILE_SIZE) for w, h in coordinates]
+        print('{}x from level {} ({} px -> {} px, {} downsample)'.format(
+            magnification, level, extraction_size, TILE_SIZE, 'integer' if factor else 'non-integer'))
+
+        quality = {}
+        images = [Image.fromarray(region) for region in regions]
+        for resample in RESAMPLE_FILTERS:
+            start = time.perf_counter()
+            tiles = [np.asarray(slide.get_tile(w, h, magnification, TILE_SIZE, resample)) for w, h in coordinates]
+            seconds = time.perf_counter() - start
+            # Resizing alone, on copies as thumbnail resizes in place.
+            copies = [image.copy() for image in images]
+            start = time.perf_counter()
+            for image in copies:
+                slide._resize(image, magnification, TILE_SIZE, resample)
+            resize_seconds = time.perf_counter() - start
+            quality[resample] = np.mean([psnr(tile, reference) for tile, reference in zip(tiles, references)])
+            floor = PSNR_FLOORS[magnification][resample]
+            print('  {:<10} get_tile {:6.0f} tiles/s  resize only {:7.0f} tiles/s  PSNR {:6.2f} dB  {}'.format(
+                resample, len(tiles) / seconds, len(tiles) / resize_seconds, quality[resample],
+                'ok' if quality[resample] >= floor else 'FAIL below {:.1f} dB'.format(floor)))
+            failed = failed or quality[resample] < floor
+        print('  most accurate: {}, default: {}'.format(max(quality, key=quality.get), slide.resample))
+        if factor is not None:
+            difference = max(int(np.abs(np.asarray(image.reduce(factor), dtype=int) -
+                                        np.asarray(image.resize((TILE_SIZE, TILE_SIZE), Image.BOX), dtype=int)).max())
+                             for image in images)
+            print('  box fast path: reduce differs from resize(BOX) by at most {}  {}'.format(
+                difference, 'ok' if difference <= 1 else 'FAIL'))
+            failed = failed or difference > 1
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
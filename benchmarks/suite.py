@@ -0,0 +1,221 @@
+"""
+Benchmark suite of the slide pipeline on synthetic pyramidal TIFF slides, no network or real WSIs needed.
+
+Times tissue mask generation, seed generation, tile sampling, tile reads (one by one and coalesced)
+and tile export for every slide size and tissue fraction, reporting throughput in items/s and MB/s
+and the peak memory allocated by Python and NumPy (tracemalloc, in a separate run so it doesn't
+slow the timings; memory of OpenSlide and of export workers is not included). Results are saved
+as JSON under a label, e.g. the version, and can be compared with an earlier run.
+
+    PYTHONPATH=. python benchmarks/suite.py --sizes 4096 8192 --tissue 0.2 0.5
+    PYTHONPATH=. python benchmarks/suite.py --label after --compare benchmarks/results/before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import warnings
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import write_synthetic_slide
+from syntax.slide import Slide
+from syntax._utils.typecheck import TYPECHECK
+from syntax.transformers import OtsuTissueMask, SimpleTiling
+from syntax.transformers.tiling import export_tiles
+from syntax.transformers.tiling.seeds import SeedSampler
+
+LEVEL0 = 40
+MAGNIFICATION = 10
+TILE_SIZE = 256
+TILE_BYTES = TILE_SIZE * TILE_SIZE * 3
+
+
+def _slide_with_mask(path, mask):
+    slide = Slide(path, level0=LEVEL0)
+    slide.tissue_mask = mask
+    return slide
+
+
+def stage_mask(path, context):
+    slide = Slide(path, level0=LEVEL0)
+    OtsuTissueMask().transform(slide)
+    context['mask'] = slide.tissue_mask
+    width, height = slide.level_dimensions[slide.tissue_mask.level]
+    return None, width * height * 3
+
+
+def stage_seeds(path, context):
+    mask = context['mask']
+    factor = Slide(path, level0=LEVEL0).level_downsamples[mask.level]
+    seeds = SeedSampler(mask.data, factor, np.random.default_rng(0))
+    seeds.take(0, len(seeds))
+    return len(seeds), None
+
+
+def stage_sampling(path, context):
+    slide = _slide_with_mask(path, context['mask'])
+    SimpleTiling(magnification=MAGNIFICATION, tile_size=TILE_SIZE, max_per_class=context['num_tiles'] + 1,
+                 seed=0).transform(slide)
+    context['tile_frame'] = slide.tile_frame
+    return len(slide.tile_frame), None
+
+
+def stage_reads(path, context):
+    slide = Slide(path, level0=LEVEL0)
+    tile_frame = context['tile_frame']
+    for w, h in zip(tile_frame['w'].tolist(), tile_frame['h'].tolist()):
+        np.asarray(slide.get_tile(w, h, MAGNIFICATION, TILE_SIZE))
+    return len(tile_frame), len(tile_frame) * TILE_BYTES
+
+
+def stage_reads_coalesced(path, context):
+    slide = Slide(path, level0=LEVEL0)
+    tile_frame = context['tile_frame']
+    slide.get_tiles(np.stack([tile_frame['w'], tile_frame['h']], axis=1), MAGNIFICATION, TILE_SIZE)
+    return len(tile_frame), len(tile_frame) * TILE_BYTES
+
+
+def stage_export(path, context):
+    slide = Slide(path, level0=LEVEL0)
+    store_dir = tempfile.mkdtemp(prefix='syntax-benchmark-store-')
+    try:
+        export_tiles(slide, store_dir, tile_frame=context['tile_frame'], num_workers=context['num_workers'])
+    finally:
+        shutil.rmtree(store_dir)
+    return len(context['tile_frame']), len(context['tile_frame']) * TILE_BYTES
+
+
+# In order, later stages use the outputs of earlier ones.
+STAGES = [('mask', stage_mask),
+          ('seeds', stage_seeds),
+          ('sampling', stage_sampling),
+          ('reads', stage_reads),
+          ('reads_coalesced', stage_reads_coalesced),
+          ('export', stage_export)]
+
+
+def run_stage(stage, path, context, repeats):
+    """Best time of repeats runs, then one run under tracemalloc for the peak memory."""
+    seconds = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        items, nbytes = stage(path, context)
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    stage(path, context)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds,
+            'items': items,
+            'items_per_s': items / seconds if items is not None else None,
+            'mb_per_s': nbytes / seconds / 2 ** 20 if nbytes is not None else None,
+            'peak_mb': peak / 2 ** 20}
+
+
+def metadata():
+    """Environment of the run, to make sense of a comparison later."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'typecheck': TYPECHECK}
+
+
+def run(sizes, tissue_fractions, num_tiles, repeats, num_workers, slide_dir, stages=None):
+    """
+    Run the stages on every synthetic slide, writing the slides to slide_dir if they're not there yet.
+    Returns:
+        list of result dicts, one per slide and stage.
+    """
+    os.makedirs(slide_dir, exist_ok=True)
+    results = []
+    for size in sizes:
+        for tissue in tissue_fractions:
+            path = os.path.join(slide_dir, 'synthetic_{}_{}.tif'.format(size, int(round(100 * tissue))))
+            if not os.path.exists(path):
+                write_synthetic_slide(path + '.tmp.tif', size, tissue)
+                os.replace(path + '.tmp.tif', path)
+            context = {'num_tiles': num_tiles, 'num_workers': num_workers}
+            for name, stage in STAGES:
+                if stages is not None and name not in stages and name != 'mask' and name != 'sampling':
+                    continue  # Mask and sampling are always run, the other stages need them.
+                result = {'size': size, 'tissue': tissue, 'stage': name}
+                result.update(run_stage(stage, path, context, repeats))
+                results.append(result)
+                print(format_result(result), flush=True)
+    return results
+
+
+def format_result(result):
+    throughput = []
+    if result['items_per_s'] is not None:
+        throughput.append('{:10.0f} items/s'.format(result['items_per_s']))
+    if result['mb_per_s'] is not None:
+        throughput.append('{:8.1f} MB/s'.format(result['mb_per_s']))
+    return '{:>6} {:>5.2f} {:<16} {:8.3f}s {:<32} peak {:7.1f} MB'.format(
+        result['size'], result['tissue'], result['stage'], result['seconds'], '  '.join(throughput), result['peak_mb'])
+
+
+def compare(results, baseline):
+    """Print the speedup of results over a baseline report, per slide and stage."""
+    base = {(r['size'], r['tissue'], r['stage']): r for r in baseline['results']}
+    print('\nspeedup vs {} ({}):'.format(baseline['label'], baseline['metadata'].get('commit')))
+    for result in results:
+        reference = base.get((result['size'], result['tissue'], result['stage']))
+        if reference is None:
+            continue
+        # Compare throughputs where there are items, runs may have sampled different numbers of tiles.
+        if result['items_per_s'] and reference['items_per_s']:
+            speedup = result['items_per_s'] / reference['items_per_s']
+        else:
+            speedup = reference['seconds'] / result['seconds']
+        print('{:>6} {:>5.2f} {:<16} {:6.2f}x  peak {:7.1f} -> {:7.1f} MB'.format(
+            result['size'], result['tissue'], result['stage'], speedup, reference['peak_mb'], result['peak_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4096, 8192], help='level 0 sides of the slides')
+    parser.add_argument('--tissue', type=float, nargs='+', default=[0.2, 0.5], help='tissue fractions')
+    parser.add_argument('--tiles', type=int, default=2000, help='tiles sampled per slide')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help='export processes, number of CPUs if not given')
+    parser.add_argument('--stages', nargs='+', default=None, choices=[name for name, _ in STAGES])
+    parser.add_argument('--slide-dir', default=os.path.join(tempfile.gettempdir(), 'syntax-benchmark-slides'))
+    parser.add_argument('--label', default=None, help='name of the results, the git commit if not given')
+    parser.add_argument('--output-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results'))
+    parser.add_argument('--compare', default=None, help='results JSON of an earlier run to compare with')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore', UserWarning)  # Synthetic slides have no annotation, SimpleTiling warns.
+
+    meta = metadata()
+    label = args.label or meta['commit'] or 'latest'
+    results = run(args.sizes, args.tissue, args.tiles, args.repeats, args.workers, args.slide_dir, args.stages)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    filename = os.path.join(args.output_dir, label + '.json')
+    with open(filename, 'w') as f:
+        json.dump({'label': label, 'metadata': meta, 'results': results}, f, indent=1)
+    print('Results saved to {}'.format(filename))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
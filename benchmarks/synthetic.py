@@ -0,0 +1,81 @@
+"""
+Synthetic pyramidal tiled TIFF slides readable by OpenSlide, for benchmarks without real WSIs.
+
+    PYTHONPATH=. python benchmarks/synthetic.py slide.tif --size 8192 --tissue 0.3
+"""
+import argparse
+import numpy as np
+import tifffile
+
+# Tissue is drawn on a grid this many times coarser than level 0, then upsampled.
+MASK_DOWNSAMPLE = 16
+
+
+def tissue_layout(size, tissue_fraction, seed=0):
+    """
+    Low resolution label map of tissue blobs covering roughly tissue_fraction of the slide.
+    Returns:
+        int array of side size // MASK_DOWNSAMPLE, 0 for background and 1.. for blobs.
+    """
+    assert 0 <= tissue_fraction <= 0.9, 'tissue_fraction must be in [0, 0.9].'
+    rng = np.random.default_rng(seed)
+    side = size // MASK_DOWNSAMPLE
+    labels = np.zeros((side, side), dtype=np.uint8)
+    yy, xx = np.mgrid[0:side, 0:side]
+    while np.mean(labels > 0) < tissue_fraction:
+        cy, cx = rng.integers(0, side, 2)
+        radius = rng.integers(side // 20 + 1, side // 6 + 2)
+        labels[(labels == 0) & ((yy - cy) ** 2 + (xx - cx) ** 2 < radius ** 2)] = rng.integers(1, 8)
+    return labels
+
+
+def write_synthetic_slide(path, size=8192, tissue_fraction=0.3, levels=4, tile=256, seed=0):
+    """
+    Write a square RGB slide with pyramid levels downsampled 4x each, zlib compressed tiles.
+    Tissue blobs are H&E like colours with noise on a pale background. OpenSlide reads it as a
+    generic tiled TIFF without objective power, so open it with Slide(path, level0=...).
+    Args:
+        path: output .tif path.
+        size: side of level 0 in pixels, a multiple of MASK_DOWNSAMPLE.
+        tissue_fraction: approximate fraction of the slide covered by tissue.
+        levels: number of pyramid levels.
+        tile: side of the TIFF tiles.
+        seed: random seed.
+
+    Returns:
+        path
+    """
+    rng = np.random.default_rng(seed)
+    labels = tissue_layout(size, tissue_fraction, seed)
+    palette = np.concatenate([[[240, 238, 242]], rng.integers([120, 40, 120], [200, 110, 200], (7, 3))])
+    palette = palette.astype(np.uint8)
+
+    image = np.empty((size, size, 3), dtype=np.uint8)
+    strip = MASK_DOWNSAMPLE * 64
+    for y in range(0, size, strip):
+        rows = labels[y // MASK_DOWNSAMPLE:(y + strip) // MASK_DOWNSAMPLE]
+        rows = np.repeat(np.repeat(rows, MASK_DOWNSAMPLE, axis=0), MASK_DOWNSAMPLE, axis=1)
+        noise = rng.integers(-12, 13, rows.shape + (3,), dtype=np.int16)
+        image[y:y + strip] = np.clip(palette[rows].astype(np.int16) + noise, 0, 255)
+
+    with tifffile.TiffWriter(path, bigtiff=image.nbytes > 2 ** 31) as tif:
+        for level in range(levels):
+            # OpenSlide only sees the pyramid if every page is marked as a reduced resolution image.
+            tif.write(image[::4 ** level, ::4 ** level], tile=(tile, tile), photometric='rgb',
+                      compression='zlib', subfiletype=1)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--size', type=int, default=8192)
+    parser.add_argument('--tissue', type=float, default=0.3, help='approximate tissue fraction')
+    parser.add_argument('--levels', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_slide(args.path, args.size, args.tissue, args.levels, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
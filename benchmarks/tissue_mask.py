@@ -0,0 +1,52 @@
+"""
+Benchmark the tissue mask backends of OtsuTissueMask on a synthetic low resolution slide.
+
+    PYTHONPATH=. python benchmarks/tissue_mask.py --size 2048 --repeats 3
+"""
+import argparse
+import time
+import numpy as np
+from syntax.transformers.tissue_mask.otsu import OtsuTissueMask
+
+
+def synthetic_rgb(size, seed=0):
+    """Pale background with a few saturated tissue blobs and salt and pepper noise."""
+    rng = np.random.default_rng(seed)
+    rgb = np.full((size, size, 3), 235, dtype=np.uint8)
+    yy, xx = np.mgrid[0:size, 0:size]
+    for _ in range(6):
+        cy, cx = rng.integers(size // 5, 4 * size // 5, 2)
+        radius = rng.integers(size // 12, size // 5)
+        rgb[(yy - cy) ** 2 + (xx - cx) ** 2 < radius ** 2] = rng.integers(60, 200, 3)
+    noise = rng.random((size, size)) < 0.02
+    rgb[noise] = rng.integers(0, 256, (noise.sum(), 3))
+    return rgb
+
+
+def time_backend(rgb, backend, repeats):
+    best, mask = np.inf, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        mask = OtsuTissueMask._mask_from_rgb(rgb, backend)
+        best = min(best, time.perf_counter() - start)
+    return best, mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2048, help='side of the synthetic mask level in pixels')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    rgb = synthetic_rgb(args.size)
+    reference_time, reference = time_backend(rgb, 'skimage', args.repeats)
+    fast_time, fast = time_backend(rgb, 'fast', args.repeats)
+    mismatch = np.mean(reference != fast)
+    print('size {0}x{0}'.format(args.size))
+    print('skimage {:.3f}s  fast {:.3f}s  speedup {:.1f}x'.format(reference_time, fast_time, reference_time / fast_time))
+    print('mismatching pixels {:.6%}'.format(mismatch))
+    assert mismatch <= 1e-4, 'fast backend differs from skimage backend.'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Tile extraction throughput with runtime type checking on (default) and off (SYNTAX_TYPECHECK=0).
+
+Each setting runs in its own process, as the switch is read when syntax is imported. Tiles are
+sampled with SimpleTiling then read one by one with Slide.get_tile on a synthetic slide.
+
+    PYTHONPATH=. python benchmarks/typecheck.py --size 8192 --tiles 2000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import warnings
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import write_synthetic_slide
+
+
+def measure(path, num_tiles, repeats):
+    """Best sampling and extraction throughputs in tiles/s, in this process."""
+    from syntax.slide import Slide
+    from syntax.transformers import OtsuTissueMask, SimpleTiling
+    warnings.simplefilter('ignore', UserWarning)
+
+    slide = Slide(path, level0=40)
+    OtsuTissueMask().transform(slide)
+    sampling, extraction = 0.0, 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        tiling = SimpleTiling(magnification=10, tile_size=256, max_per_class=num_tiles + 1, seed=0)
+        tile_frame = tiling.transform(slide).tile_frame
+        sampling = max(sampling, len(tile_frame) / (time.perf_counter() - start))
+        del slide.tile_frame
+
+        start = time.perf_counter()
+        for w, h in zip(tile_frame['w'].tolist(), tile_frame['h'].tolist()):
+            np.asarray(slide.get_tile(w, h, 10, 256))
+        extraction = max(extraction, len(tile_frame) / (time.perf_counter() - start))
+    return {'tiles': len(tile_frame), 'sampling': sampling, 'extraction': extraction}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=8192)
+    parser.add_argument('--tiles', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--slide-dir', default=os.path.join(tempfile.gettempdir(), 'syntax-benchmark-slides'))
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    path = os.path.join(args.slide_dir, 'synthetic_{}_50.tif'.format(args.size))
+    if args.child:
+        print(json.dumps(measure(path, args.tiles, args.repeats)))
+        return
+    if not os.path.exists(path):
+        os.makedirs(args.slide_dir, exist_ok=True)
+        write_synthetic_slide(path + '.tmp.tif', args.size, 0.5)
+        os.replace(path + '.tmp.tif', path)
+
+    results = {}
+    for setting in ['1', '0']:
+        env = dict(os.environ, SYNTAX_TYPECHECK=setting)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--size', str(args.size),
+                                 '--tiles', str(args.tiles), '--repeats', str(args.repeats),
+                                 '--slide-dir', args.slide_dir], env=env, check=True, capture_output=True, text=True)
+        results[setting] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    on, off = results['1'], results['0']
+    print('{} tiles of 256px at 10x from a {}px slide'.format(on['tiles'], args.size))
+    for name in ['sampling', 'extraction']:
+        print('{:<10} typecheck on {:8.0f} tiles/s  off {:8.0f} tiles/s  speedup {:.2f}x'.format(
+            name, on[name], off[name], off[name] / on[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,10 +19,17 @@ setup(
                       'typeguard',
                       'pandas',
                       'scikit-image',
+                      'scipy',
                       ],
+    # Worker pools need ProcessPoolExecutor initializers (3.7) and SharedTileBuffer shared_memory (3.8).
+    python_requires='>=3.8',
     classifiers=[
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 3.6'
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ]
 )
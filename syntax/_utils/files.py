@@ -0,0 +1,41 @@
+import os
+import json
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def save_json_atomic(path, data, **kwargs):
+    """
+    Write data as JSON to path atomically, so an interrupted run never leaves the file half written.
+    Args:
+        path: destination file.
+        data: JSON serialisable data.
+        **kwargs: passed to json.dump, e.g. indent.
+    """
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock between processes, held while in the context, e.g. around a read-modify-write of a
+    file that many processes update. Uses flock on path, created if needed. Where flock isn't available
+    (Windows) the lock does nothing.
+    Args:
+        path: lock file.
+    """
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,26 @@
+import sys
+import types
+import importlib
+
+
+class _LazyModule(types.ModuleType):
+    """Placeholder of a module, imported on first attribute access."""
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)  # Later lookups don't go through __getattr__.
+        return getattr(module, attribute)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Module that is only imported when one of its attributes is first used, to keep heavy optional
+    dependencies (matplotlib, scikit-image, pandas) out of processes that don't need them.
+    Annotations using the module must be strings so they aren't evaluated at import.
+    Args:
+        name: full name of the module, e.g. 'skimage.morphology'.
+
+    Returns:
+        the module if already imported, else a placeholder for it.
+    """
+    return sys.modules.get(name) or _LazyModule(name)
@@ -1,6 +1,6 @@
 import os
 import glob
-from typeguard import typechecked
+from syntax._utils.typecheck import typechecked
 from typing import Any, List, Tuple
 
 @typechecked
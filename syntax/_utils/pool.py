@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _run_pool(function, tasks, num_workers, context, on_result, initializer, initargs):
+    """
+    Run tasks on a fresh pool, keeping at most num_workers in flight so that a dead worker
+    can be narrowed down to them.
+    Returns:
+        (tasks in flight when a worker died, tasks not submitted yet)
+    """
+    pending = tasks[::-1]
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             mp_context=context,
+                             initializer=initializer,
+                             initargs=initargs) as pool:
+        while pending or in_flight:
+            while pending and len(in_flight) < num_workers:
+                task = pending.pop()
+                in_flight[pool.submit(function, *task)] = task
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    return [task] + list(in_flight.values()), pending[::-1]
+                on_result(task, result)
+    return [], []
+
+
+def run_isolating_crashes(function, tasks, num_workers, context, on_result, on_crash, initializer=None, initargs=()):
+    """
+    Run function(*task) for each task on a pool of processes, surviving workers that die (e.g. segfault
+    in a native library). The tasks that were in flight when a worker died are rerun one at a time to
+    find the offending one, and the rest carry on in parallel.
+    Args:
+        function: picklable function run in the workers.
+        tasks: list of tuples of arguments of function.
+        num_workers: number of processes.
+        context: multiprocessing context.
+        on_result: called with (task, result) in the parent as tasks complete.
+        on_crash: called with a task that killed its worker when run alone. Returns a list of tasks to \
+                  run one at a time in its place, e.g. the parts of a chunk, or [] to give up on it.
+        initializer: called in every worker when it starts.
+        initargs: arguments of initializer.
+    """
+    pending = list(tasks)
+    while pending:
+        suspects, pending = _run_pool(function, pending, num_workers, context, on_result, initializer, initargs)
+        while suspects:
+            crashed, suspects = _run_pool(function, suspects, 1, context, on_result, initializer, initargs)
+            for task in crashed:
+                suspects = on_crash(task) + suspects
@@ -0,0 +1,26 @@
+import os
+from functools import partial
+from typeguard import typechecked as _typechecked
+
+# Runtime type checking of annotated functions and classes, on unless the environment variable
+# SYNTAX_TYPECHECK is set to 0 (e.g. in production). Read once, when syntax is imported.
+TYPECHECK = os.environ.get('SYNTAX_TYPECHECK', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def typechecked(func=None, **kwargs):
+    """
+    typeguard.typechecked, or a no-op decorator if type checking is switched off with SYNTAX_TYPECHECK=0,
+    so decorated functions are called directly without any overhead. As with typeguard, checks are also
+    off when Python runs with -O.
+    Args:
+        func: function or class to decorate.
+        **kwargs: passed to typeguard.typechecked.
+
+    Returns:
+        the decorated function or class.
+    """
+    if func is None:
+        return partial(typechecked, **kwargs)
+    if not TYPECHECK:
+        return func
+    return _typechecked(func, **kwargs)
@@ -1 +1,3 @@
-from syntax.slide.slide import Slide
\ No newline at end of file
+from syntax.slide.slide import Slide
+from syntax.slide.profile import SlideProfile, profile_frame
+from syntax.slide.annotation import Annotation, AnnotationReader
@@ -0,0 +1,356 @@
+import os
+import json
+import warnings
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+from PIL import Image, ImageDraw
+from syntax._utils.typecheck import typechecked
+from typing import Dict, List, Optional, Tuple
+from syntax.slide.slide import Slide
+
+
+@typechecked
+class AnnotationReader(object):
+    """Polygon annotations of a slide, read from an ASAP XML or a QuPath GeoJSON file.
+
+    ASAP annotations are labelled by their group, GeoJSON features by their classification name
+    (QuPath) or name property. Points, lines and other shapes without an area are skipped.
+    Coordinates are in the frame of reference slide level 0.
+
+    Attributes:
+        path (str): Annotation file.
+        labels (dict): Class of each label, an integer in [1, 255]. Class 0 is unannotated.
+        polygons (list): (class, exterior, holes) of each polygon, exterior is an (N, 2) float array \
+                         of (w, h) vertices and holes a list of such arrays.
+
+    """
+
+    def __init__(self, path: str, labels: Optional[Dict[str, int]] = None):
+        """
+
+        Args:
+            path: .xml (ASAP) or .json/.geojson (GeoJSON) annotation file.
+            labels: Class of each label. Polygons with other labels are skipped. \
+                    If None the labels found are numbered from 1 in alphabetical order.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        assert extension in ['.xml', '.json', '.geojson'], 'Annotations must be ASAP XML or GeoJSON.'
+        shapes = self._read_asap(path) if extension == '.xml' else self._read_geojson(path)
+        if labels is None:
+            labels = {label: c for c, label in enumerate(sorted({label for label, _, _ in shapes}), 1)}
+        assert all(0 < c < 256 for c in labels.values()), 'Classes must be in [1, 255].'
+        self.path = path
+        self.labels = dict(labels)
+        self.polygons = [(labels[label], exterior, holes) for label, exterior, holes in shapes if label in labels]
+        skipped = sorted({label for label, _, _ in shapes if label not in labels})
+        if skipped:
+            warnings.warn('Skipped polygons of {} with labels {}'.format(path, ', '.join(skipped)))
+
+    @property
+    def classes(self) -> List[int]:
+        """Annotated classes."""
+        return sorted(set(self.labels.values()))
+
+    def label_to_pixel(self, c: int) -> int:
+        """
+        Value of class c in rasterized annotations, e.g. tiles of Annotation.get_tile.
+        Args:
+            c: class, 0 for unannotated.
+
+        Returns:
+            pixel value
+        """
+        assert c == 0 or c in self.labels.values(), 'Unknown class {}.'.format(c)
+        return c
+
+    @staticmethod
+    def _read_asap(path):
+        """(label, exterior, holes) of the polygons of an ASAP XML file."""
+        shapes = []
+        for annotation in ElementTree.parse(path).getroot().iter('Annotation'):
+            coordinates = sorted(annotation.iter('Coordinate'), key=lambda e: int(e.get('Order', 0)))
+            # Some locales write decimal commas.
+            exterior = np.asarray([[float(e.get('X').replace(',', '.')), float(e.get('Y').replace(',', '.'))]
+                                   for e in coordinates]).reshape(-1, 2)
+            if len(exterior) < 3:
+                continue
+            label = annotation.get('PartOfGroup', 'None')
+            if label == 'None':
+                label = annotation.get('Name', 'annotation')
+            shapes.append((label, exterior, []))
+        return shapes
+
+    @staticmethod
+    def _read_geojson(path):
+        """(label, exterior, holes) of the polygons of a GeoJSON file, a FeatureCollection or list of Features."""
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            features = data['features'] if 'features' in data else [data]
+        else:
+            features = data
+        shapes = []
+        for feature in features:
+            geometry = feature.get('geometry') or {}
+            properties = feature.get('properties') or {}
+            label = (properties.get('classification') or {}).get('name') or properties.get('name') or 'annotation'
+            if geometry.get('type') == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            for rings in polygons:
+                rings = [np.asarray(ring, dtype=float).reshape(len(ring), -1)[:, :2] for ring in rings]
+                if rings and len(rings[0]) >= 3:
+                    shapes.append((label, rings[0], rings[1:]))
+        return shapes
+
+
+@typechecked
+class Annotation(object):
+    """Annotation of a slide, rasterized at low resolution to seed tile sampling and indexed to score tiles.
+
+    The index is a grid of square cells over level 0 holding, for each cell, the pieces of the polygons
+    clipped to it. The class fractions of a tile are the areas of the pieces of the cells it overlaps
+    clipped to the tile, so scoring a tile costs the same whatever the number and size of the polygons,
+    and no region is rasterized. Pieces lying inside the tile aren't clipped at all.
+
+    Overlapping polygons, frequent in QuPath exports, are resolved in file order: later polygons cover
+    earlier ones, in rasters as in fractions. Areas can't be added up where pieces of several polygons
+    may overlap, so the fractions of tiles touching such pieces are counted on the raster of the tile
+    (get_tile) instead, at the cost of rasterizing it.
+
+    Attributes:
+        reader (AnnotationReader): Polygons.
+        level (int): Slide level of the low resolution raster.
+        cell_size (float): Side of the index cells in level 0 pixels.
+
+    """
+
+    def __init__(self, reader: AnnotationReader, slide: Slide, level: Optional[int] = None,
+                 cell_size: float = 2048):
+        """
+
+        Args:
+            reader: Polygons of the slide.
+            slide: Slide annotated.
+            level: Slide level of the low resolution raster, defaults to the lowest resolution.
+            cell_size: Side of the index cells in level 0 pixels, at least the level 0 size of tiles.
+        """
+        self.reader = reader
+        self.level = slide.level_count - 1 if level is None else level
+        self.factor = float(slide.level_downsamples[self.level])
+        self.dimensions = slide.level_dimensions[self.level]
+        self.level0 = slide.level0
+        self.cell_size = cell_size
+        self._low_res = None
+        pieces = {}
+        for order, (c, exterior, holes) in enumerate(reader.polygons):
+            for sign, ring in [(1, exterior)] + [(-1, hole) for hole in holes]:
+                for cell, piece in self._split(ring):
+                    pieces.setdefault(cell, []).append((order, c, sign, piece))
+        # Per cell, the pieces and arrays of their order, class, signed area, bounds (w0, h0, w1, h1) and
+        # whether they may overlap a piece of another polygon, i.e. their bounds do.
+        self._cells = {}
+        for cell, cell_pieces in pieces.items():
+            order, classes, signs, points = zip(*cell_pieces)
+            order = np.asarray(order)
+            bounds = np.asarray([np.r_[p.min(axis=0), p.max(axis=0)] for p in points])
+            overlaps = ((bounds[:, None, 0] < bounds[None, :, 2]) & (bounds[None, :, 0] < bounds[:, None, 2]) &
+                        (bounds[:, None, 1] < bounds[None, :, 3]) & (bounds[None, :, 1] < bounds[:, None, 3]) &
+                        (order[:, None] != order[None, :]))
+            self._cells[cell] = (list(points),
+                                 order,
+                                 np.asarray(classes),
+                                 np.asarray(signs) * np.asarray([_areas(p, np.asarray([len(p)]))[0] for p in points]),
+                                 bounds,
+                                 overlaps.any(axis=1))
+
+    @property
+    def identity(self) -> dict:
+        """What the annotation of a slide depends on, to key cached results."""
+        stat = os.stat(self.reader.path)
+        return {'path': os.path.realpath(self.reader.path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'labels': self.reader.labels, 'level': self.level}
+
+    def get_low_res_numpy(self) -> Tuple[np.ndarray, float]:
+        """
+        Classes rasterized at the annotation level, computed once.
+        Returns:
+            (uint8 array of classes, downsample of the array relative to level 0)
+        """
+        if self._low_res is None:
+            image = Image.new('L', self.dimensions, 0)
+            draw = ImageDraw.Draw(image)
+            for c, exterior, holes in self.reader.polygons:
+                draw.polygon([tuple(p) for p in (exterior / self.factor).tolist()], fill=c, outline=c)
+                for hole in holes:
+                    draw.polygon([tuple(p) for p in (hole / self.factor).tolist()], fill=0)
+            self._low_res = np.asarray(image)
+        return self._low_res, self.factor
+
+    def get_tile(self, w_ref: int, h_ref: int, magnification, effective_size: int) -> np.ndarray:
+        """
+        Classes of a tile rasterized from the polygon pieces it overlaps.
+        Args:
+            w_ref: Width coordinate in frame of reference slide level 0.
+            h_ref: Height coordinate in frame of reference slide level 0.
+            magnification: Desired magnification.
+            effective_size: Desired tile size.
+
+        Returns:
+            (effective_size, effective_size) uint8 array of classes.
+        """
+        extent = effective_size * self.level0 / magnification
+        scale = effective_size / extent
+        image = Image.new('L', (effective_size, effective_size), 0)
+        draw = ImageDraw.Draw(image)
+        pieces = []
+        for points, order, classes, areas, bounds, _ in self._overlapping(w_ref, h_ref, extent):
+            for i in np.flatnonzero(self._touching(bounds, w_ref, h_ref, extent)).tolist():
+                pieces.append((order[i], areas[i] < 0, int(classes[i]), points[i]))
+        # Holes after the exterior of their polygon.
+        for _, hole, c, piece in sorted(pieces, key=lambda piece: piece[:2]):
+            draw.polygon([tuple(p) for p in ((piece - (w_ref, h_ref)) * scale).tolist()], fill=0 if hole else c)
+        return np.asarray(image)
+
+    def get_class_fractions(self, w_ref: int, h_ref: int, magnification, effective_size) -> Dict[int, float]:
+        """
+        Fraction of a tile covered by each class, from the polygons clipped to the tile, or from the
+        raster of the tile where overlapping polygons touch it.
+        Args:
+            w_ref: Width coordinate in frame of reference slide level 0.
+            h_ref: Height coordinate in frame of reference slide level 0.
+            magnification: Desired magnification.
+            effective_size: Desired tile size.
+
+        Returns:
+            fraction of each class in the tile, class 0 is the unannotated rest.
+        """
+        extent = effective_size * self.level0 / magnification
+        w1, h1 = w_ref + extent, h_ref + extent
+        classes, areas, crossing = [], [], []
+        for points, order, cell_classes, signed_areas, bounds, overlaps in self._overlapping(w_ref, h_ref, extent):
+            touching = self._touching(bounds, w_ref, h_ref, extent)
+            if self._overlap_in_tile(order[touching & overlaps], bounds[touching & overlaps], w_ref, h_ref, w1, h1):
+                return self._raster_fractions(w_ref, h_ref, magnification, effective_size)
+            inside = touching & (bounds[:, 0] >= w_ref) & (bounds[:, 1] >= h_ref) & \
+                (bounds[:, 2] <= w1) & (bounds[:, 3] <= h1)
+            # Pieces inside the tile count whole, the others crossing its border are clipped to it.
+            classes.append(cell_classes[inside])
+            areas.append(signed_areas[inside])
+            crossing.extend((points[i], cell_classes[i], signed_areas[i]) for i in np.flatnonzero(touching & ~inside))
+        if crossing:
+            points, crossing_classes, signed_areas = zip(*crossing)
+            lengths = np.asarray([len(p) for p in points])
+            points, lengths = _clip(np.concatenate(points), lengths, 0, w_ref, w1)
+            points, lengths = _clip(points, lengths, 1, h_ref, h1)
+            classes.append(np.asarray(crossing_classes))
+            areas.append(np.sign(signed_areas) * _areas(points, lengths))
+        classes, areas = np.concatenate(classes or [[]]).astype(int), np.concatenate(areas or [[]])
+        totals = np.bincount(classes, weights=areas).tolist()
+        fractions = {c: min(max(totals[c] / extent ** 2, 0.0), 1.0) for c in np.unique(classes).tolist()}
+        fractions[0] = max(1.0 - sum(fractions.values()), 0.0)
+        return fractions
+
+    def get_class_fraction(self, c: int, w_ref: int, h_ref: int, magnification, effective_size) -> float:
+        """
+        Fraction of a tile covered by class c, see get_class_fractions.
+        Args:
+            c: class, 0 for unannotated.
+            w_ref: Width coordinate in frame of reference slide level 0.
+            h_ref: Height coordinate in frame of reference slide level 0.
+            magnification: Desired magnification.
+            effective_size: Desired tile size.
+
+        Returns:
+            fraction
+        """
+        return self.get_class_fractions(w_ref, h_ref, magnification, effective_size).get(c, 0.0)
+
+    @staticmethod
+    def _overlap_in_tile(order, bounds, w0, h0, w1, h1):
+        """Whether the bounds of pieces of different polygons overlap within the tile (w0, h0, w1, h1)."""
+        if len(bounds) < 2:
+            return False
+        bounds = np.clip(bounds, [w0, h0, w0, h0], [w1, h1, w1, h1])
+        return bool(((bounds[:, None, 0] < bounds[None, :, 2]) & (bounds[None, :, 0] < bounds[:, None, 2]) &
+                     (bounds[:, None, 1] < bounds[None, :, 3]) & (bounds[None, :, 1] < bounds[:, None, 3]) &
+                     (order[:, None] != order[None, :])).any())
+
+    def _raster_fractions(self, w_ref, h_ref, magnification, effective_size):
+        """Class fractions of a tile counted on its raster, where later polygons cover earlier ones."""
+        counts = np.bincount(self.get_tile(w_ref, h_ref, magnification, effective_size).ravel(), minlength=256)
+        fractions = {c: float(counts[c] / counts.sum()) for c in np.flatnonzero(counts).tolist()}
+        fractions[0] = fractions.get(0, 0.0)
+        return fractions
+
+    def _overlapping(self, w_ref, h_ref, extent):
+        """Index entries of the cells overlapped by the tile of side extent at (w_ref, h_ref)."""
+        size = self.cell_size
+        for row in range(int(h_ref // size), int(-(-(h_ref + extent) // size))):
+            for col in range(int(w_ref // size), int(-(-(w_ref + extent) // size))):
+                if (row, col) in self._cells:
+                    yield self._cells[row, col]
+
+    @staticmethod
+    def _touching(bounds, w_ref, h_ref, extent):
+        """Whether the bounding boxes overlap the tile of side extent at (w_ref, h_ref)."""
+        return ((bounds[:, 0] < w_ref + extent) & (bounds[:, 2] > w_ref) &
+                (bounds[:, 1] < h_ref + extent) & (bounds[:, 3] > h_ref))
+
+    def _split(self, ring):
+        """Pieces of a ring clipped to the cells it overlaps, as ((row, col), piece)."""
+        size = self.cell_size
+        for col in range(int(ring[:, 0].min() // size), int(ring[:, 0].max() // size) + 1):
+            strip, _ = _clip(ring, np.asarray([len(ring)]), 0, col * size, (col + 1) * size)
+            if len(strip) < 3:
+                continue
+            for row in range(int(strip[:, 1].min() // size), int(strip[:, 1].max() // size) + 1):
+                piece, lengths = _clip(strip, np.asarray([len(strip)]), 1, row * size, (row + 1) * size)
+                if len(piece) >= 3 and _areas(piece, lengths)[0] > 0:
+                    yield (row, col), piece
+
+
+def _clip(points, lengths, axis, low, high):
+    """
+    Sutherland-Hodgman clipping of polygons to low <= coordinate axis <= high, all polygons at once.
+    Args:
+        points: (N, 2) vertices of the polygons one after the other.
+        lengths: number of vertices of each polygon.
+
+    Returns:
+        (points, lengths) of the clipped polygons, with 0 vertices for those outside the bounds.
+    """
+    for bound, sign in ((low, 1), (high, -1)):
+        x = points[:, axis]
+        inside = sign * (x - bound) >= 0
+        if inside.all():
+            continue
+        previous = points[_shift(lengths, -1)]
+        crossing = inside != inside[_shift(lengths, -1)]
+        delta = x - previous[:, axis]
+        t = np.divide(bound - previous[:, axis], delta, out=np.zeros_like(delta), where=crossing)
+        # Each edge emits its intersection with the bound if it crosses it, then its end if inside.
+        emitted = np.stack([crossing, inside], axis=1)
+        polygon = np.repeat(np.arange(len(lengths)), lengths)
+        lengths = np.bincount(polygon, weights=emitted.sum(axis=1), minlength=len(lengths)).astype(int)
+        points = np.stack([previous + t[:, None] * (points - previous), points], axis=1)[emitted]
+    return points, lengths
+
+
+def _areas(points, lengths):
+    """Unsigned areas of polygons with the shoelace formula, vertices as in _clip."""
+    following = points[_shift(lengths, 1)]
+    cross = points[:, 0] * following[:, 1] - points[:, 1] * following[:, 0]
+    return np.abs(np.bincount(np.repeat(np.arange(len(lengths)), lengths), weights=cross,
+                              minlength=len(lengths))) / 2
+
+
+def _shift(lengths, step):
+    """Index of the next (step 1) or previous (step -1) vertex of each vertex, within its polygon."""
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    lengths = np.repeat(lengths, lengths)
+    index = np.arange(len(starts))
+    return starts + (index - starts + step) % lengths
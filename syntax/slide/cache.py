@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from syntax._utils.typecheck import typechecked
+from typing import Any, Dict, Hashable
+
+@typechecked
+class TileCache(object):
+    """Thread-safe LRU cache of decoded tiles bounded by a memory budget in bytes.
+
+    Least recently used tiles are evicted until the cached tiles fit the budget, a tile larger
+    than the whole budget is never cached.
+
+    Attributes:
+        max_bytes (int): Memory budget of the cache.
+        hits (int): Number of lookups that found their tile.
+        misses (int): Number of lookups that didn't.
+        evictions (int): Number of tiles evicted to respect the budget.
+
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+
+        Args:
+            max_bytes: Memory budget of the cache.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory currently used by cached tiles."""
+        return self._bytes
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Get a tile and mark it as most recently used.
+        Args:
+            key:
+
+        Returns:
+            the tile or None if not cached.
+        """
+        with self._lock:
+            item = self._tiles.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, tile: Any, nbytes: int):
+        """
+        Add a tile, evicting least recently used tiles to stay within the budget.
+        Args:
+            key:
+            tile:
+            nbytes: memory used by the tile.
+        """
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._tiles:
+                self._bytes -= self._tiles.pop(key)[1]
+            self._tiles[key] = (tile, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._tiles.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all tiles, counters are kept."""
+        with self._lock:
+            self._tiles.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Counters and memory use of the cache."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'tiles': len(self._tiles),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes}
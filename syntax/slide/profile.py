@@ -0,0 +1,145 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+from syntax._utils.imports import lazy_import
+from syntax._utils.typecheck import typechecked
+from typing import Any, Dict, List, Optional
+
+pd = lazy_import('pandas')
+
+
+@typechecked
+class SlideProfile(object):
+    """Per-slide report of where the time of a pipeline goes.
+
+    Filled in by a Slide created with profile=True (read_region calls, pixels and bytes per level),
+    by Pipeline (wall and CPU time of each transformer) and by the tilings (accepted and rejected
+    tiles). Nothing is recorded, and nothing costs, unless the slide has a profile.
+
+    Attributes:
+        slide_id (str): ID of the profiled slide.
+        steps (list): dicts with name, wall and cpu seconds and cached, one per transformer run.
+        reads (dict): level -> dict with calls, pixels and bytes read.
+        counters (dict): name -> dict of counts, e.g. SimpleTiling -> accepted, rejected_tissue.
+
+    """
+
+    def __init__(self, slide_id: str):
+        """
+
+        Args:
+            slide_id: ID of the profiled slide.
+        """
+        self.slide_id = slide_id
+        self.steps = []
+        self.reads = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name: str, cached: bool = False):
+        """
+        Time the body of the with statement as a step.
+        Args:
+            name: name of the step, e.g. the transformer class.
+            cached: whether the step was loaded from a cache.
+
+        Yields:
+            the record of the step, e.g. to set cached from within the body.
+        """
+        record = {'name': name, 'wall': 0.0, 'cpu': 0.0, 'cached': cached}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            self.steps.append(record)
+
+    def record_read(self, level: int, width: int, height: int):
+        """
+        Record a read_region call. Regions are decoded to RGBA, 4 bytes per pixel.
+        Args:
+            level: level read.
+            width: width of the region.
+            height: height of the region.
+        """
+        with self._lock:  # Tiles may be read by several threads, see iterate_tiles.
+            reads = self.reads.setdefault(level, {'calls': 0, 'pixels': 0, 'bytes': 0})
+            reads['calls'] += 1
+            reads['pixels'] += width * height
+            reads['bytes'] += 4 * width * height
+
+    def add_counts(self, name: str, counts: Dict[str, int]):
+        """
+        Add counts to the counters of name.
+        Args:
+            name: e.g. the transformer class.
+            counts: name of the count -> increment.
+        """
+        counters = self.counters.setdefault(name, {})
+        for key, value in counts.items():
+            counters[key] = counters.get(key, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The report as a JSON serializable dict."""
+        return {'slide_id': self.slide_id,
+                'steps': [dict(step) for step in self.steps],
+                'reads': {str(level): dict(reads) for level, reads in sorted(self.reads.items())},
+                'counters': {name: dict(counts) for name, counts in self.counters.items()}}
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """
+        The report as JSON.
+        Args:
+            path: if given the JSON is also written there.
+
+        Returns:
+            JSON string
+        """
+        report = json.dumps(self.to_dict(), indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(report)
+        return report
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """The report as a long DataFrame, see profile_frame."""
+        return profile_frame([self.to_dict()])
+
+
+@typechecked
+def profile_frame(reports: List[Dict[str, Any]]) -> 'pd.DataFrame':
+    """
+    Long DataFrame of many slide reports, e.g. the profiles of a run_batch manifest, to aggregate with groupby.
+    Args:
+        reports: SlideProfile.to_dict() reports.
+
+    Returns:
+        DataFrame with columns slide_id, section ('steps', 'reads' or 'counters'), name (step, level
+        or counter group), metric and value. Steps run several times are summed.
+    """
+    rows = []
+    for report in reports:
+        slide_id = report['slide_id']
+        for step in report['steps']:
+            for metric in ['wall', 'cpu', 'cached']:
+                rows.append((slide_id, 'steps', step['name'], metric, float(step[metric])))
+        for level, reads in report['reads'].items():
+            for metric, value in reads.items():
+                rows.append((slide_id, 'reads', level, metric, float(value)))
+        for name, counts in report['counters'].items():
+            for metric, value in counts.items():
+                rows.append((slide_id, 'counters', name, metric, float(value)))
+    frame = pd.DataFrame(rows, columns=['slide_id', 'section', 'name', 'metric', 'value'])
+    return frame.groupby(['slide_id', 'section', 'name', 'metric'], as_index=False, sort=False)['value'].sum()
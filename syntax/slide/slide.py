@@ -1,8 +1,20 @@
 from openslide import OpenSlide
 import os
-from typeguard import typechecked
-from typing import Optional
-from syntax._utils import misc
+import numpy as np
+from PIL import Image
+from syntax._utils.typecheck import typechecked
+from typing import Any, List, Optional, Tuple, Union
+from syntax.slide.cache import TileCache
+from syntax.slide.profile import SlideProfile
+
+# Filters to resize tiles read at a higher magnification. 'box' averages blocks of pixels, with a fast path
+# for integer downsamples, 'thumbnail' is PIL's thumbnail (box reduce then bicubic), the default.
+RESAMPLE_FILTERS = {'box': Image.BOX,
+                    'nearest': Image.NEAREST,
+                    'bilinear': Image.BILINEAR,
+                    'bicubic': Image.BICUBIC,
+                    'lanczos': Image.LANCZOS,
+                    'thumbnail': None}
 
 @typechecked
 class Slide(OpenSlide):
@@ -24,20 +36,36 @@ class Slide(OpenSlide):
 
     def __init__(self,
                  slide_path: str,
-                 level0: Optional[int] = None,
-                 verbose: Optional[bool] = False):
+                 level0: Optional[float] = None,
+                 verbose: Optional[bool] = False,
+                 tile_cache_bytes: int = 0,
+                 profile: bool = False,
+                 resample: str = 'thumbnail'):
         """
 
         Args:
             slide_path: Path to the WSI readable by openslide.
             level0: The 'magnification' at level 0. If 'infer' we attempt to get from metadata.
             verbose:
+            tile_cache_bytes: Memory budget of the LRU cache of decoded tiles used by get_tile. \
+                              No cache if 0.
+            profile: If True read_region calls are recorded, with the pipeline steps and tiling counts, \
+                     in the SlideProfile self.profile.
+            resample: Default filter to resize tiles read at a higher magnification, see RESAMPLE_FILTERS. \
+                      'box' is several times faster for integer downsamples.
         """
+        assert resample in RESAMPLE_FILTERS, 'resample must be one of {}.'.format(list(RESAMPLE_FILTERS))
         super(Slide, self).__init__(slide_path)
         self.verbose = verbose
+        self.path = slide_path
+        self.tile_cache = TileCache(tile_cache_bytes) if tile_cache_bytes > 0 else None
+        self.resample = resample
+        self._plans = {}
+        self._thumbnails = {}
 
         # Get slide id for reference
         self.ID = os.path.splitext(os.path.basename(slide_path))[0]
+        self.profile = SlideProfile(self.ID) if profile else None
 
         # Add level0 magnification.
         if level0 == None:
@@ -53,7 +81,7 @@ class Slide(OpenSlide):
         # Compute level magnifications.
         self._magnification_list = [self.level0 / downsample for downsample in self.level_downsamples]
 
-    def get_tile(self, w: int, h: int, magnification: int, size: int):
+    def get_tile(self, w: int, h: int, magnification: int, size: int, resample: Optional[str] = None):
         """
         Get a tile.
         If required magnification not available will use a higher magnification and resize.
@@ -62,23 +90,216 @@ class Slide(OpenSlide):
             h: Height coordinate in level 0 frame.
             magnification: Desired magnification.
             size: Desired tile size (square tile).
+            resample: Filter to resize the tile, see RESAMPLE_FILTERS. Defaults to self.resample.
 
         Returns:
 
         """
-        assert self.level0 >= magnification, 'Magnification not available.'
+        resample = resample or self.resample
+        extraction_level, extraction_size, _ = self._plan(magnification, size)
 
-        higher_mags = [self.magnifications[i] >= magnification for i in range(len(self.magnifications))]
-        extraction_level = misc.index_last_non_zero(higher_mags)
-        extraction_mag = self.magnifications[extraction_level]
-        extraction_size = int(size * extraction_mag / magnification)
+        if self.tile_cache is not None:
+            key = (extraction_level, w, h, size, magnification, resample)
+            tile = self.tile_cache.get(key)
+            if tile is not None:
+                return tile.copy()  # Copy so callers can't modify the cached tile.
 
         # Make sure it's RGB (not e.g. RGBA).
         tile = self.read_region((w, h), extraction_level, (extraction_size, extraction_size)).convert('RGB')
-        if extraction_size != size:
-            tile.thumbnail((size, size))  # Resize inplace.
+        tile = self._resize(tile, magnification, size, resample)
+
+        if self.tile_cache is not None:
+            self.tile_cache.put(key, tile.copy(), tile.width * tile.height * len(tile.getbands()))
         return tile
 
+    def get_tile_array(self,
+                       w: int,
+                       h: int,
+                       magnification: int,
+                       size: int,
+                       resample: Optional[str] = None,
+                       out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Get a tile as a uint8 (size, size, 3) array, optionally written into a caller's buffer.
+        The alpha channel is sliced off the region OpenSlide decodes rather than converted with PIL,
+        the result is identical to np.asarray(get_tile(...)).
+        Args:
+            w: Width coordinate in level 0 frame.
+            h: Height coordinate in level 0 frame.
+            magnification: Desired magnification.
+            size: Desired tile size (square tile).
+            resample: Filter to resize the tile, see RESAMPLE_FILTERS. Defaults to self.resample.
+            out: uint8 (size, size, 3) array to write the tile into, e.g. a row of a batch or of shared memory.
+
+        Returns:
+            out, or a new array if out is None.
+        """
+        if self.tile_cache is not None:
+            tile = np.asarray(self.get_tile(w, h, magnification, size, resample))
+        else:
+            tile = self._read_tile_array(w, h, magnification, size, resample or self.resample)
+        if out is None:
+            return np.ascontiguousarray(tile)
+        out[...] = tile
+        return out
+
+    def read_region(self, location, level, size):
+        """OpenSlide read_region, recorded in the profile if the slide has one."""
+        if self.profile is not None:
+            self.profile.record_read(int(level), int(size[0]), int(size[1]))
+        return super(Slide, self).read_region(location, level, size)
+
+    def get_tiles(self,
+                  coordinates: Any,
+                  magnification: int,
+                  size: int,
+                  max_region_size: int = 2048,
+                  resample: Optional[str] = None,
+                  out: Optional[np.ndarray] = None) -> Union[List[Any], np.ndarray]:
+        """
+        Get many tiles, coalescing neighbouring tiles into larger regions that are read once.
+        Tiles are grouped by cells of max_region_size pixels at the extraction level and each group is
+        read with a single read_region, tiles are then sliced out of it as views. Tiles whose origins
+        fall on different sub-pixel offsets at the extraction level, and sparse groups, are read
+        separately so every tile is identical to the one get_tile returns. With a tile cache, cached
+        tiles aren't read and the tiles read are added to the cache, as with get_tile.
+        Args:
+            coordinates: (N, 2) array or list of (w, h) in level 0 frame.
+            magnification: Desired magnification.
+            size: Desired tile size (square tile).
+            max_region_size: Bound on the side of a coalesced region at the extraction level, \
+                             a region spans at most max_region_size + tile extent pixels.
+            resample: Filter to resize the tiles, see RESAMPLE_FILTERS. Defaults to self.resample.
+            out: uint8 (N, size, size, 3) array to write the tiles into, e.g. a preallocated batch or \
+                 shared memory, so no per-tile arrays are kept.
+
+        Returns:
+            list of N uint8 (size, size, 3) arrays in the order of coordinates, or out if given.
+        """
+        resample = resample or self.resample
+        extraction_level, extraction_size, _ = self._plan(magnification, size)
+
+        coordinates = np.asarray(coordinates, dtype=np.int64).reshape(-1, 2)
+        if out is not None:
+            assert out.shape == (coordinates.shape[0], size, size, 3) and out.dtype == np.uint8, \
+                'out must be a uint8 array of shape (N, size, size, 3).'
+        # Item assignment copies into out, or stores arrays in the list.
+        tiles = out if out is not None else [None] * coordinates.shape[0]
+
+        cache = self.tile_cache
+
+        def key(i):
+            return extraction_level, int(coordinates[i, 0]), int(coordinates[i, 1]), size, magnification, resample
+
+        def store(i, tile):
+            tiles[i] = tile
+            if cache is not None:
+                cache.put(key(i), Image.fromarray(np.array(tile)), tile.nbytes)
+
+        def read_one(i):
+            tile = self._read_tile_array(int(coordinates[i, 0]), int(coordinates[i, 1]), magnification, size, resample)
+            store(i, np.ascontiguousarray(tile))
+
+        pending = np.arange(coordinates.shape[0])
+        if cache is not None:
+            missing = []
+            for i in range(coordinates.shape[0]):
+                tile = cache.get(key(i))
+                if tile is None:
+                    missing.append(i)
+                else:
+                    tiles[i] = np.array(tile)  # Copy so callers can't modify the cached tile.
+            pending = np.asarray(missing, dtype=np.int64)
+
+        downsample = self.level_downsamples[extraction_level]
+        if pending.shape[0] == 0:
+            return tiles
+        if downsample != int(downsample):
+            # Regions can't be aligned to the level's pixel grid, read every tile separately.
+            for i in pending.tolist():
+                read_one(i)
+            return tiles
+
+        # Tiles can only share a region if their origins have the same sub-pixel offset at the extraction level.
+        downsample = int(downsample)
+        residue = coordinates % downsample
+        level_xy = coordinates // downsample
+        cell = level_xy[pending] // max_region_size
+        _, groups = np.unique(np.concatenate([residue[pending], cell], axis=1), axis=0, return_inverse=True)
+        order = np.argsort(groups.ravel(), kind='stable')
+        splits = np.flatnonzero(np.diff(groups.ravel()[order])) + 1
+
+        for group in np.split(pending[order], splits):
+            x0, y0 = level_xy[group].min(axis=0)
+            x1, y1 = level_xy[group].max(axis=0) + extraction_size
+            if len(group) == 1 or (x1 - x0) * (y1 - y0) > 2 * len(group) * extraction_size ** 2:
+                # Single or sparse tiles, a bounding region would mostly be thrown away.
+                for i in group.tolist():
+                    read_one(i)
+                continue
+            rw, rh = residue[group[0]]
+            location = (int(x0 * downsample + rw), int(y0 * downsample + rh))
+            region = self.read_region(location, extraction_level, (int(x1 - x0), int(y1 - y0)))
+            region = np.asarray(region)[:, :, :3]  # Drop alpha without converting.
+            for i in group.tolist():
+                x, y = level_xy[i, 0] - x0, level_xy[i, 1] - y0
+                tile = region[y:y + extraction_size, x:x + extraction_size]
+                if extraction_size != size:
+                    tile = np.asarray(self._resize(Image.fromarray(tile), magnification, size, resample))
+                store(i, tile)
+        return tiles
+
+    def get_thumbnail(self, size: Tuple[int, int]) -> Image.Image:
+        """
+        RGB thumbnail of the slide fitting in size, keeping the aspect ratio. Computed once per size.
+        Args:
+            size: (width, height) bounds.
+
+        Returns:
+            PIL image, a copy that can be drawn on.
+        """
+        size = (int(size[0]), int(size[1]))
+        if size not in self._thumbnails:
+            self._thumbnails[size] = super(Slide, self).get_thumbnail(size)
+        return self._thumbnails[size].copy()
+
+    def _read_tile_array(self, w, h, magnification, size, resample):
+        """Read a tile as a uint8 array, bypassing the tile cache."""
+        extraction_level, extraction_size, _ = self._plan(magnification, size)
+        region = self.read_region((w, h), extraction_level, (extraction_size, extraction_size))
+        if extraction_size == size:
+            return np.asarray(region)[:, :, :3]
+        return np.asarray(self._resize(region.convert('RGB'), magnification, size, resample))
+
+    def _plan(self, magnification, size):
+        """
+        Extraction plan of tiles of a magnification and size, computed once per slide.
+        Returns:
+            (extraction level, tile size at that level, integer downsample factor or None).
+        """
+        plan = self._plans.get((magnification, size))
+        if plan is None:
+            assert self.level0 >= magnification, 'Magnification not available.'
+            # Lowest resolution level with at least the desired magnification.
+            extraction_level = max(i for i, mag in enumerate(self.magnifications) if mag >= magnification)
+            extraction_size = int(size * self.magnifications[extraction_level] / magnification)
+            factor = extraction_size // size if extraction_size % size == 0 else None
+            plan = self._plans[(magnification, size)] = (extraction_level, extraction_size, factor)
+        return plan
+
+    def _resize(self, tile, magnification, size, resample):
+        """Resize a tile read at the extraction level to size."""
+        _, extraction_size, factor = self._plan(magnification, size)
+        if extraction_size == size:
+            return tile
+        if resample == 'thumbnail':
+            tile.thumbnail((size, size))  # Resize inplace.
+            return tile
+        assert resample in RESAMPLE_FILTERS, 'resample must be one of {}.'.format(list(RESAMPLE_FILTERS))
+        if resample == 'box' and factor is not None:
+            return tile.reduce(factor)  # Mean of factor x factor blocks.
+        return tile.resize((size, size), RESAMPLE_FILTERS[resample])
+
     @property
     def magnifications(self):
         return self._magnification_list
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typeguard import typechecked
+from syntax._utils.typecheck import typechecked
 from syntax.slide.slide import Slide
 from typing import List
 
@@ -1,4 +1,6 @@
 from syntax.transformers.tissue_mask.otsu import OtsuTissueMask
 from syntax.transformers.tiling.tiling import SimpleTiling
-from syntax.transformers.base import Pipeline
+from syntax.transformers.tiling.grid import GridTiling
+from syntax.transformers.base import Pipeline, TransformerCache
+from syntax.transformers.batch import run_batch
 from syntax.transformers.utils import visualize_pipeline_results
\ No newline at end of file
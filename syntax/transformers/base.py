@@ -1,12 +1,43 @@
+import os
 import abc
+import json
+import pickle
+import hashlib
+import inspect
+import threading
+from contextlib import contextmanager
 from copy import deepcopy
-from typeguard import typechecked
-from typing import List, Any
+from syntax._utils.typecheck import typechecked
+from typing import List, Any, Dict, Optional, Tuple
+
+CACHE_VERSION = 1
+
+
+@contextmanager
+def _untimed():
+    """Stand-in for SlideProfile.step when the slide isn't profiled."""
+    yield {}
+
 
 class BaseTransformer(abc.ABC):
     """The base transformer class from which all other transformers should inherit.
     The interface is analogous to the sklearn Transformer interface."""
 
+    # Slide attributes set by transform that a TransformerCache stores. Empty if the transformer isn't cached.
+    cached_attributes: Tuple[str, ...] = ()
+
+    @property
+    def deterministic(self) -> bool:
+        """Whether transform gives the same output for the same slide and parameters. If not, neither its
+        output nor that of the transformers after it in a Pipeline is cached."""
+        return True
+
+    def get_params(self) -> Dict[str, Any]:
+        """Parameters of the transformer, the attributes named after the arguments of __init__."""
+        names = [name for name, parameter in inspect.signature(type(self).__init__).parameters.items()
+                 if name != 'self' and parameter.kind not in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD)]
+        return {name: getattr(self, name) for name in names}
+
     @abc.abstractclassmethod
     def fit(self, slide, target=None):
         raise NotImplementedError
@@ -55,14 +86,18 @@ class Pipeline(BaseTransformer):
     and then returns X_tmp
     """
 
-    def __init__(self, transformers: List[Any]):
+    def __init__(self, transformers: List[Any], cache: Optional['TransformerCache'] = None):
         """
 
 
         Args:
             transformers: Transf
+            cache: If given, outputs of cached transformers are loaded from it when the slide and the \
+                   parameters of the transformer and all those before it are unchanged, else computed and stored. \
+                   Transformers after a non deterministic one, e.g. SimpleTiling without a seed, aren't cached.
         """
         self.transformers = transformers
+        self.cache = cache
 
     def __len__(self):
         return len(self.steps)
@@ -78,14 +113,226 @@ class Pipeline(BaseTransformer):
         return self
 
     def transform(self, slide):
-        slide_output = slide
-        for transformer in self.transformers:
-            slide_output = transformer.transform(slide_output)
-        return slide_output
+        return self._run(slide, fit=False)
 
     def fit_transform(self, slide):
+        return self._run(slide, fit=True)
+
+    def _run(self, slide, fit):
         slide_output = slide
+        key = self.cache.slide_key(slide) if self.cache is not None else None
         for transformer in self.transformers:
-            slide_output = transformer.fit_transform(slide=slide_output)
+            if key is not None:
+                # Chain the keys, a step's output depends on every step before it.
+                key = self.cache.step_key(key, transformer) if transformer.deterministic else None
+            cached = key is not None and len(transformer.cached_attributes) > 0
+            profile = getattr(slide_output, 'profile', None)
+            timer = profile.step(type(transformer).__name__) if profile is not None else _untimed()
+            with timer as record:
+                if cached and self.cache.load(key, slide_output):
+                    record['cached'] = True
+                    continue
+                if fit:
+                    slide_output = transformer.fit_transform(slide=slide_output)
+                else:
+                    slide_output = transformer.transform(slide_output)
+                if cached:
+                    self.cache.save(key, slide_output, transformer.cached_attributes)
         return slide_output
 
+
+@typechecked
+class TransformerCache(object):
+    """Content-addressed disk cache of transformer outputs, shared by Pipeline runs and processes.
+
+    An entry is keyed by the identity of the slide (path, size, modification time and level0, or a hash of
+    its content) and the class and parameters of a transformer and all the transformers before it in
+    the pipeline. It holds the slide attributes the transformer sets, e.g. tissue_mask or tile_frame.
+    Entries are written atomically, the least recently used are evicted to respect the size limit.
+
+    Attributes:
+        cache_dir (str): Directory of the cache.
+        max_bytes (int): Size limit of the cache on disk.
+        content_hash (bool): If True slides are identified by a hash of their content.
+        hits (int): Number of entries loaded by this process.
+        misses (int): Number of entries not found by this process.
+
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 10 * 2 ** 30, content_hash: bool = False):
+        """
+
+        Args:
+            cache_dir: Directory of the cache, created if needed.
+            max_bytes: Size limit of the cache on disk.
+            content_hash: If True slides are identified by a hash of their content, which survives copies \
+                          and touches but reads every slide once per process. Else by path, size and mtime.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        self._content_hashes = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks can't be pickled, e.g. when the pipeline is sent to run_batch workers.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def slide_key(self, slide: Any) -> str:
+        """
+        Key identifying a slide file, and its annotation file if any.
+        Args:
+            slide: Slide, with a path attribute.
+
+        Returns:
+            hex digest
+        """
+        path = os.path.realpath(slide.path)
+        stat = os.stat(path)
+        if self.content_hash:
+            identity = {'content': self._hash_file(path, stat)}
+        else:
+            identity = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        identity.update(version=CACHE_VERSION, level0=slide.level0)
+        if getattr(slide, 'annotation', None) is not None:
+            identity['annotation'] = slide.annotation.identity
+        return self._hash(identity)
+
+    def step_key(self, previous_key: str, transformer: Any) -> str:
+        """
+        Key of the output of a transformer applied after the step with key previous_key.
+        Args:
+            previous_key: key of the previous step, or of the slide for the first step.
+            transformer: BaseTransformer
+
+        Returns:
+            hex digest
+        """
+        cls = type(transformer)
+        try:
+            params = transformer.get_params()
+        except AttributeError:
+            # Arguments stored under other names, the attributes of the instance identify it instead.
+            params = vars(transformer)
+        return self._hash({'previous': previous_key,
+                           'class': '{}.{}'.format(cls.__module__, cls.__qualname__),
+                           'params': params})
+
+    def load(self, key: str, slide: Any) -> bool:
+        """
+        Set the cached attributes of an entry on the slide.
+        Args:
+            key: step key
+            slide: slide to set the attributes on
+
+        Returns:
+            True if the entry was found.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                attributes = pickle.load(f)
+            os.utime(path)  # Mark as recently used.
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            # Missing, or evicted by another process while reading.
+            with self._lock:
+                self.misses += 1
+            return False
+        for name, value in attributes.items():
+            setattr(slide, name, value)
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def save(self, key: str, slide: Any, attributes: Tuple[str, ...]):
+        """
+        Store attributes of the slide, then evict least recently used entries beyond max_bytes.
+        Args:
+            key: step key
+            slide: transformed slide
+            attributes: names of the attributes to store, those the slide doesn't have are skipped.
+        """
+        path = self._path(key)
+        values = {name: getattr(slide, name) for name in attributes if hasattr(slide, name)}
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def clear(self):
+        """Remove all entries."""
+        for entry, _ in self._entries():
+            self._remove(entry)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the cache on disk."""
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of this process and size of the cache."""
+        entries = self._entries()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(stat.st_size for _, stat in entries),
+                'max_bytes': self.max_bytes}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def _entries(self):
+        """(path, stat) of all entries."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pickle'):
+                try:
+                    entries.append((entry.path, entry.stat()))
+                except FileNotFoundError:
+                    pass
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(stat.st_size for _, stat in entries)
+        if total <= self.max_bytes:
+            return
+        for path, stat in sorted(entries, key=lambda entry: entry[1].st_mtime_ns):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= stat.st_size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Removed by another process.
+
+    def _hash_file(self, path, stat):
+        """SHA-256 of the file, memoized by path, size and mtime."""
+        memo_key = (path, stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._content_hashes:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2 ** 20), b''):
+                    digest.update(block)
+            self._content_hashes[memo_key] = digest.hexdigest()
+        return self._content_hashes[memo_key]
+
+    @staticmethod
+    def _hash(obj):
+        # repr for parameters that aren't JSON, e.g. numpy values.
+        return hashlib.sha256(json.dumps(obj, sort_keys=True, default=repr).encode()).hexdigest()
+
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import zlib
+import warnings
+import traceback
+import multiprocessing
+import numpy as np
+from syntax._utils.files import save_json_atomic
+from syntax._utils.pool import run_isolating_crashes
+from syntax._utils.typecheck import typechecked
+from typing import Any, Dict, List, Optional
+from syntax.slide.slide import Slide
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def load_manifest(output_dir: str) -> Dict[str, Any]:
+    """
+    Load the manifest of a batch run, empty if there is none yet.
+    Args:
+        output_dir: output directory of the batch run
+
+    Returns:
+        dict of batch slide ID (see batch_slide_id) to its entry (status, path, outputs, error, seconds).
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def batch_slide_id(slide_path: str) -> str:
+    """
+    ID of a slide in a batch run, keying its manifest entry and naming its outputs. The slide name
+    followed by a hash of its absolute path, so slides of the same name in different directories
+    (e.g. site1/001.svs and site2/001.svs) don't overwrite each other.
+    Args:
+        slide_path: path of the slide
+
+    Returns:
+        ID, e.g. '001_3f2a9c1b'
+    """
+    name = os.path.splitext(os.path.basename(slide_path))[0]
+    return '{}_{:08x}'.format(name, zlib.crc32(os.path.abspath(slide_path).encode()))
+
+
+def _process_slide(slide_path, pipeline, output_dir, level0, profile=False):
+    """Run the pipeline on one slide in a worker and save its results. Never raises."""
+    start = time.time()
+    entry = {'path': slide_path, 'outputs': {}, 'error': None}
+    ID = batch_slide_id(slide_path)
+    try:
+        slide = Slide(slide_path, level0=level0, profile=profile)
+        slide = pipeline.fit_transform(slide)
+        if hasattr(slide, 'tissue_mask'):
+            entry['outputs']['tissue_mask'] = slide.tissue_mask.save(ID, output_dir)
+        if hasattr(slide, 'tile_frame'):
+            if hasattr(slide.tile_frame, 'to_pickle'):
+                filename = os.path.join(output_dir, ID + '_tile_frame.pickle')
+                slide.tile_frame.to_pickle(filename)
+            else:
+                filename = os.path.join(output_dir, ID + '_tile_frame.npy')
+                np.save(filename, slide.tile_frame)
+            entry['outputs']['tile_frame'] = filename
+        if slide.profile is not None:
+            entry['profile'] = slide.profile.to_dict()
+        entry['status'] = 'done'
+    except Exception:
+        entry['status'] = 'failed'
+        entry['error'] = traceback.format_exc()
+    entry['seconds'] = time.time() - start
+    return entry
+
+
+@typechecked
+def run_batch(slide_paths: List[str],
+              pipeline: Any,
+              output_dir: str,
+              num_workers: Optional[int] = None,
+              level0: Optional[float] = None,
+              retry_failed: bool = True,
+              mp_context: Optional[str] = None,
+              verbose: bool = False,
+              profile: bool = False) -> Dict[str, Any]:
+    """
+    Run a pipeline over many slides concurrently on a pool of processes.
+    Each slide's tissue_mask and tile_frame are saved to output_dir, named by batch_slide_id, and its
+    outcome is recorded in output_dir/manifest.json as soon as it finishes. Slides already marked done in the manifest
+    are skipped, so an interrupted run resumes where it stopped. A failing slide (exception or dead
+    worker) is recorded as failed with its error and does not stop the batch.
+    Args:
+        slide_paths: paths of the slides to process.
+        pipeline: Pipeline (or any transformer) to fit_transform each slide with.
+        output_dir: where results and the manifest are written.
+        num_workers: number of processes, defaults to the number of CPUs.
+        level0: level 0 magnification passed to every Slide, inferred from metadata if None.
+        retry_failed: whether slides marked failed in the manifest are run again.
+        mp_context: multiprocessing start method, e.g. 'spawn'. Platform default if None.
+        verbose:
+        profile: if True slides are profiled and each entry has a SlideProfile report under 'profile', \
+                 see syntax.slide.profile.profile_frame to aggregate them.
+
+    Returns:
+        the manifest, dict of batch slide ID (see batch_slide_id) to its entry \
+        (status, path, outputs, error, seconds).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    skip = ['done', 'failed'] if not retry_failed else ['done']
+    pending = [p for p in slide_paths if manifest.get(batch_slide_id(p), {}).get('status') not in skip]
+    if verbose:
+        print('Skipping {} finished slides, {} to process.'.format(len(slide_paths) - len(pending), len(pending)))
+    num_workers = num_workers or os.cpu_count()
+    context = multiprocessing.get_context(mp_context)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+    def on_result(task, entry):
+        # Recorded as soon as a slide finishes, so an interrupted run resumes from there.
+        slide_path = task[0]
+        manifest[batch_slide_id(slide_path)] = entry
+        save_json_atomic(manifest_path, manifest, indent=1, sort_keys=True)
+        if verbose:
+            print('{} {} in {:.1f}s'.format(batch_slide_id(slide_path), entry['status'], entry['seconds']))
+
+    def on_crash(task):
+        slide_path = task[0]
+        on_result(task, {'path': slide_path, 'outputs': {}, 'status': 'failed',
+                         'error': 'Worker died while processing slide.', 'seconds': None})
+        return []
+
+    tasks = [(slide_path, pipeline, output_dir, level0, profile) for slide_path in pending]
+    run_isolating_crashes(_process_slide, tasks, num_workers, context, on_result, on_crash)
+
+    failed = [p for p in slide_paths if manifest[batch_slide_id(p)]['status'] == 'failed']
+    if failed:
+        warnings.warn('{} slides failed, see {}'.format(len(failed), manifest_path))
+    return manifest
@@ -1 +1,6 @@
-from syntax.transformers.tiling.tiling import SimpleTiling
\ No newline at end of file
+from syntax.transformers.tiling.tiling import SimpleTiling
+from syntax.transformers.tiling.grid import GridTiling
+from syntax.transformers.tiling.loader import iterate_tiles
+from syntax.transformers.tiling.store import export_tiles, TileStore
+from syntax.transformers.tiling.shared import SharedTileBuffer
+from syntax.transformers.tiling.parallel import extract_tiles
@@ -0,0 +1,134 @@
+import numpy as np
+from syntax._utils.imports import lazy_import
+from syntax._utils.typecheck import typechecked
+from typing import Union
+
+pd = lazy_import('pandas')
+
+TILE_FRAME_COLUMNS = ['tile_id', 'w', 'h', 'class', 'mag', 'size', 'parent', 'lvl0']
+TILE_FRAME_DTYPES = {'tile_id': np.int32,
+                     'w': np.int32,
+                     'h': np.int32,
+                     'class': np.int32,
+                     'mag': np.int16,
+                     'size': np.int32,
+                     'lvl0': np.float32}
+
+class TileFrameBuilder(object):
+    """Collects tile records into preallocated typed columns and builds the tile_frame once at the end.
+
+    Columns tile_id, w, h and class vary per tile and are grown by doubling when the initial
+    capacity is exceeded. Columns mag, size, parent and lvl0 are constant for a slide. add runs
+    once per tile so its arguments aren't type checked, unlike those of the other methods.
+
+    Attributes:
+        parent (str): ID of the slide the tiles come from.
+        mag (int): Magnification of the tiles.
+        size (int): Size of the tiles.
+        lvl0 (float): Magnification at level 0 of the slide.
+
+    """
+
+    @typechecked
+    def __init__(self, parent: str, mag: int, size: int, lvl0: float, capacity: int = 1024):
+        """
+
+        Args:
+            parent: ID of the slide the tiles come from.
+            mag: Magnification of the tiles.
+            size: Size of the tiles.
+            lvl0: Magnification at level 0 of the slide.
+            capacity: Number of tiles to preallocate for.
+        """
+        self.parent = parent
+        self.mag = mag
+        self.size = size
+        self.lvl0 = lvl0
+        self._columns = {name: np.empty(max(capacity, 1), dtype=TILE_FRAME_DTYPES[name])
+                         for name in ['tile_id', 'w', 'h', 'class']}
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def add(self, tile_id: int, w: int, h: int, c: int):
+        """
+        Add a single tile record.
+        Args:
+            tile_id:
+            w: Width coordinate in level 0 frame.
+            h: Height coordinate in level 0 frame.
+            c: class
+        """
+        self._reserve(1)
+        i = self._length
+        self._columns['tile_id'][i] = tile_id
+        self._columns['w'][i] = w
+        self._columns['h'][i] = h
+        self._columns['class'][i] = c
+        self._length += 1
+
+    @typechecked
+    def extend(self, tile_id: np.ndarray, w: np.ndarray, h: np.ndarray, c: Union[int, np.ndarray]):
+        """
+        Add many tile records at once.
+        Args:
+            tile_id: array of tile ids
+            w: array of width coordinates in level 0 frame.
+            h: array of height coordinates in level 0 frame.
+            c: class, a single one for all tiles or an array.
+        """
+        n = len(tile_id)
+        self._reserve(n)
+        i = self._length
+        self._columns['tile_id'][i:i + n] = tile_id
+        self._columns['w'][i:i + n] = w
+        self._columns['h'][i:i + n] = h
+        self._columns['class'][i:i + n] = c
+        self._length += n
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """
+        Build the tile_frame as a DataFrame with compact dtypes and a categorical parent.
+        """
+        n = self._length
+        data = {
+            'tile_id': self._columns['tile_id'][:n].copy(),
+            'w': self._columns['w'][:n].copy(),
+            'h': self._columns['h'][:n].copy(),
+            'class': self._columns['class'][:n].copy(),
+            'mag': np.full(n, self.mag, dtype=TILE_FRAME_DTYPES['mag']),
+            'size': np.full(n, self.size, dtype=TILE_FRAME_DTYPES['size']),
+            'parent': pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[self.parent]),
+            'lvl0': np.full(n, self.lvl0, dtype=TILE_FRAME_DTYPES['lvl0']),
+        }
+        return pd.DataFrame(data, columns=TILE_FRAME_COLUMNS)
+
+    def to_records(self) -> np.ndarray:
+        """
+        Build the tile_frame as a structured NumPy array with the same columns as to_frame.
+        """
+        n = self._length
+        dtype = [(name, TILE_FRAME_DTYPES[name]) if name != 'parent' else (name, 'U{}'.format(max(len(self.parent), 1)))
+                 for name in TILE_FRAME_COLUMNS]
+        records = np.empty(n, dtype=dtype)
+        for name in ['tile_id', 'w', 'h', 'class']:
+            records[name] = self._columns[name][:n]
+        records['mag'] = self.mag
+        records['size'] = self.size
+        records['parent'] = self.parent
+        records['lvl0'] = self.lvl0
+        return records
+
+    def _reserve(self, n: int):
+        """Make sure there is room for n more records, doubling the capacity as needed."""
+        required = self._length + n
+        capacity = len(self._columns['w'])
+        if required <= capacity:
+            return
+        while capacity < required:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._length] = column[:self._length]
+            self._columns[name] = grown
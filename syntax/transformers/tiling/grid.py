@@ -0,0 +1,122 @@
+import warnings
+from syntax._utils.typecheck import typechecked
+import numpy as np
+from syntax.transformers.base import StaticTransformer
+from syntax.transformers.tiling.tiling import SimpleTiling
+from syntax.transformers.tiling.frame import TileFrameBuilder
+from syntax.slide import Slide
+
+@typechecked
+class GridTiling(StaticTransformer):
+    """Tiles a slide exhaustively on a regular grid, keeping only the grid cells on tissue.
+
+    The grid is laid at the requested magnification with a stride of tile_size - overlap pixels
+    and all cells are scored against the tissue mask in one vectorized call. The result is a
+    tile_frame with the same schema as SimpleTiling, tiles are numbered by their position in
+    the full grid (row-major) and all have class 0.
+
+    Attributes:
+        magnification (int): Magnification of the tiles.
+        tile_size (int): Size of the tiles.
+        overlap (int): Overlap of neighbouring tiles in pixels at the tile magnification.
+        tissue_threshold (float): Minimum fraction of tissue in a tile for it to be kept.
+
+    """
+
+    cached_attributes = ('tile_frame',)
+
+    def __init__(self,
+                 magnification: int,
+                 tile_size: int,
+                 overlap: int = 0,
+                 tissue_threshold: float = 0.9,
+                 frame_format: str = 'pandas'):
+        """
+
+        Args:
+            magnification: Magnification of the tiles.
+            tile_size: Size of the tiles.
+            overlap: Overlap of neighbouring tiles in pixels at the tile magnification.
+            tissue_threshold: Minimum fraction of tissue in a tile for it to be kept.
+            frame_format: 'pandas' for a DataFrame tile_frame or 'numpy' for a structured array.
+        """
+        assert 0 <= overlap < tile_size, 'Overlap must be smaller than the tile size.'
+        assert frame_format in ['pandas', 'numpy'], 'frame_format must be pandas or numpy.'
+        self.magnification = magnification
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.tissue_threshold = tissue_threshold
+        self.frame_format = frame_format
+
+    @property
+    def stride(self) -> int:
+        """Distance between neighbouring tiles in pixels at the tile magnification."""
+        return self.tile_size - self.overlap
+
+    def transform(self, slide: Slide, target=None):
+        """
+        Lay the grid over the slide and add the tiles on tissue to the slide as a tile_frame.
+        No slide pixels are read, tiles are read on demand from the tile_frame.
+        Args:
+            slide:
+            target:
+
+        Returns:
+            slide with tile_frame attribute
+        """
+        # Check if slide already has tile-frame if it does, then just return it as it is
+        if hasattr(slide, "tile_frame"):
+            warnings.warn("{} slide already has tile_frame, yet has been passed to GridTiling".format(slide.ID))
+            return slide
+
+        assert hasattr(slide, "tissue_mask"), "Slide {} does not have tissue mask!".format(slide.ID)
+
+        slide.tile_frame = self._grid_tiles(slide)
+        return slide
+
+    @staticmethod
+    def visualize(slide: Slide, size: int):
+        """
+        Thumbnail visualisation of the transformer application
+        Args:
+            slide:
+            size:
+
+        Returns:
+
+        """
+        return SimpleTiling.visualize(slide, size)
+
+    def _grid_tiles(self, slide: Slide):
+        """Build the tile_frame of all grid cells that pass the tissue threshold."""
+        assert slide.level0 >= self.magnification, 'Magnification not available.'
+        scale = slide.level0 / self.magnification
+        extent = int(self.tile_size * scale)  # Tile size in level 0 frame.
+        stride = self.stride * scale  # Stride in level 0 frame.
+        width, height = slide.dimensions
+
+        # Only whole tiles, cell origins in level 0 frame.
+        ws = (np.arange(max(int((width - extent) // stride) + 1, 0)) * stride).astype(np.int64)
+        hs = (np.arange(max(int((height - extent) // stride) + 1, 0)) * stride).astype(np.int64)
+        grid_h, grid_w = np.meshgrid(hs, ws, indexing='ij')
+        grid_h, grid_w = grid_h.ravel(), grid_w.ravel()
+
+        fractions = slide.tissue_mask.get_tissue_fractions(grid_w, grid_h, self.magnification, self.tile_size)
+        keep = np.flatnonzero(fractions >= self.tissue_threshold)
+
+        builder = TileFrameBuilder(parent=slide.ID,
+                                   mag=self.magnification,
+                                   size=self.tile_size,
+                                   lvl0=slide.level0,
+                                   capacity=keep.size)
+        builder.extend(keep, grid_w[keep], grid_h[keep], 0)
+
+        if slide.verbose:
+            print('Kept {} of {} grid tiles for file {}'.format(keep.size, fractions.size, slide.ID))
+        if getattr(slide, 'profile', None) is not None:
+            slide.profile.add_counts(type(self).__name__, {'accepted': int(keep.size),
+                                                           'rejected_tissue': int(fractions.size - keep.size)})
+
+        if self.frame_format == 'numpy':
+            return builder.to_records()
+        return builder.to_frame()
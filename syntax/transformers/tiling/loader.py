@@ -0,0 +1,81 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from syntax._utils.typecheck import typechecked
+from typing import Any, Optional
+from syntax.slide import Slide
+
+
+def _frame_rows(tile_frame, index):
+    """Rows of a DataFrame or structured array tile_frame."""
+    if hasattr(tile_frame, 'iloc'):
+        return tile_frame.iloc[index]
+    return tile_frame[index]
+
+
+def _load_batch(slide, tile_frame, index, magnification, size, coalesce):
+    """Read the tiles of a batch into a (B, size, size, 3) uint8 array."""
+    rows = _frame_rows(tile_frame, index)
+    coordinates = np.stack([np.asarray(rows['w']), np.asarray(rows['h'])], axis=1)
+    batch = np.empty((len(index), size, size, 3), dtype=np.uint8)
+    if coalesce:
+        slide.get_tiles(coordinates, magnification, size, out=batch)
+    else:
+        for i, (w, h) in enumerate(coordinates.tolist()):
+            slide.get_tile_array(w, h, magnification, size, out=batch[i])
+    return batch, rows
+
+
+@typechecked
+def iterate_tiles(slide: Slide,
+                  tile_frame: Optional[Any] = None,
+                  batch_size: int = 32,
+                  shuffle: bool = False,
+                  seed: Optional[int] = None,
+                  prefetch: int = 4,
+                  num_threads: int = 2,
+                  coalesce: bool = True):
+    """
+    Iterate over the tiles of a tile_frame in fixed-size batches, read ahead by background threads.
+    At most prefetch batches are read ahead, so memory stays bounded whatever the size of the tile_frame.
+    Args:
+        slide: slide the tiles come from.
+        tile_frame: DataFrame or structured array of tiles, defaults to slide.tile_frame. \
+                    All tiles must have the same magnification and size.
+        batch_size: number of tiles per batch, the last batch may be smaller.
+        shuffle: if True tiles are visited in a random order, else in tile_frame order.
+        seed: random seed for the shuffled order.
+        prefetch: number of batches read ahead.
+        num_threads: number of threads reading batches.
+        coalesce: if True neighbouring tiles of a batch are read together with Slide.get_tiles.
+
+    Yields:
+        (uint8 array of shape (B, size, size, 3), tile_frame rows of the batch)
+    """
+    if tile_frame is None:
+        tile_frame = slide.tile_frame
+    num_tiles = len(tile_frame)
+    if num_tiles == 0:
+        return
+    magnifications = np.unique(np.asarray(tile_frame['mag']))
+    sizes = np.unique(np.asarray(tile_frame['size']))
+    assert len(magnifications) == 1 and len(sizes) == 1, 'All tiles must have the same magnification and size.'
+    magnification, size = int(magnifications[0]), int(sizes[0])
+
+    order = np.random.default_rng(seed).permutation(num_tiles) if shuffle else np.arange(num_tiles)
+    batches = iter(np.array_split(order, range(batch_size, num_tiles, batch_size)))
+
+    executor = ThreadPoolExecutor(max_workers=num_threads)
+    queue = deque()
+    try:
+        for index in batches:
+            queue.append(executor.submit(_load_batch, slide, tile_frame, index, magnification, size, coalesce))
+            if len(queue) > prefetch:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+    finally:
+        # Generator closed early, don't read batches nobody will consume.
+        for future in queue:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,115 @@
+import os
+import warnings
+import multiprocessing
+import numpy as np
+from syntax._utils.pool import run_isolating_crashes
+from syntax._utils.typecheck import typechecked
+from typing import Any, List, Optional
+from syntax.slide.slide import Slide
+from syntax.transformers.tiling.shared import SharedTileBuffer
+
+# Slide opened once per worker process, OpenSlide handles can't be shared between processes.
+_worker_slide = None
+
+
+def _init_worker(slide_path, level0, resample='thumbnail'):
+    global _worker_slide
+    _worker_slide = Slide(slide_path, level0=level0, resample=resample)
+
+
+def _tile_filename(save_dir, info):
+    return os.path.join(save_dir, '{}_class_{}_from_{}.png'.format(info['tile_id'], info['class'], info['parent']))
+
+
+def _extract_chunk(records, save_dir, out=None, start=0):
+    """
+    Read the tiles of a chunk of records in a worker. Tiles are written to rows start... of out if given,
+    and True is returned in their place. Failed tiles give (None, error message).
+    """
+    results = []
+    for k, info in enumerate(records):
+        try:
+            if out is not None:
+                _worker_slide.get_tile_array(int(info['w']), int(info['h']), int(info['mag']), int(info['size']),
+                                             out=out.array[start + k])
+                results.append((True, None))
+                continue
+            tile = _worker_slide.get_tile(int(info['w']), int(info['h']), int(info['mag']), int(info['size']))
+            if save_dir is None:
+                results.append((np.asarray(tile), None))
+            else:
+                filename = _tile_filename(save_dir, info)
+                tile.save(filename)
+                results.append((filename, None))
+        except Exception as e:
+            results.append((None, '{}: {}'.format(type(e).__name__, e)))
+    return results
+
+
+@typechecked
+def extract_tiles(slide: Slide,
+                  tile_frame: Optional[Any] = None,
+                  num_workers: Optional[int] = None,
+                  save_dir: Optional[str] = None,
+                  chunk_size: int = 64,
+                  mp_context: Optional[str] = None,
+                  out: Optional[SharedTileBuffer] = None) -> List[Any]:
+    """
+    Read the tiles of a tile_frame in parallel over a pool of processes, each with its own Slide.
+    If a worker dies (e.g. segfault on a corrupt region) the chunks it may have been reading are rerun
+    one at a time to find the offending tile, which is returned as None, and the rest carry on in parallel.
+    Args:
+        slide: slide the tiles come from, only its path and level0 are sent to the workers.
+        tile_frame: DataFrame or structured array of tiles, defaults to slide.tile_frame.
+        num_workers: number of processes, defaults to the number of CPUs.
+        save_dir: if given tiles are saved there as PNG files instead of being returned as arrays.
+        chunk_size: number of tiles read by a worker per task.
+        mp_context: multiprocessing start method, e.g. 'spawn'. Platform default if None.
+        out: shared memory buffer with a row per tile, workers write the tiles straight into it instead of \
+             sending them back. All tiles must have the buffer's size.
+
+    Returns:
+        list in tile_frame order of uint8 (size, size, 3) arrays (rows of out if given), or filenames if \
+        save_dir is given. Tiles that could not be read are None.
+    """
+    if tile_frame is None:
+        tile_frame = slide.tile_frame
+    if hasattr(tile_frame, 'to_dict'):
+        records = tile_frame.to_dict('records')
+    else:
+        records = [dict(zip(tile_frame.dtype.names, row.tolist())) for row in tile_frame]
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+    if out is not None:
+        assert save_dir is None, 'Tiles are either saved or written to out.'
+        assert len(out) == len(records), 'out must have a row per tile.'
+    num_workers = num_workers or os.cpu_count()
+    context = multiprocessing.get_context(mp_context)
+
+    results = [None] * len(records)
+    errors = {}
+
+    def on_result(task, chunk_results):
+        for i, (result, error) in enumerate(chunk_results, task[3]):
+            results[i] = result
+            if error is not None:
+                errors[i] = error
+
+    def on_crash(task):
+        # A chunk that kills its worker alone is split into single tiles.
+        chunk, start = task[0], task[3]
+        if len(chunk) == 1:
+            errors[start] = 'Worker died while reading tile.'
+            return []
+        return [([info], save_dir, out, start + k) for k, info in enumerate(chunk)]
+
+    tasks = [(records[start:start + chunk_size], save_dir, out, start) for start in range(0, len(records), chunk_size)]
+    run_isolating_crashes(_extract_chunk, tasks, num_workers, context, on_result, on_crash,
+                          initializer=_init_worker, initargs=(slide.path, slide.level0, slide.resample))
+
+    if errors:
+        warnings.warn('Failed to read {} of {} tiles from {}, first error: {}'.format(
+            len(errors), len(records), slide.ID, errors[min(errors)]))
+    if out is not None:
+        results = [out.array[i] if result is not None else None for i, result in enumerate(results)]
+    return results
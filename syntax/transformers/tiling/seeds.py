@@ -0,0 +1,96 @@
+import numpy as np
+from syntax._utils.typecheck import typechecked
+from typing import Optional, Tuple
+
+class SeedSampler(object):
+    """Random seed coordinates drawn lazily from the non-zero pixels of a low resolution mask.
+
+    The non-zero pixel indices are kept as a single integer array and a random permutation
+    of them is built chunk by chunk (partial Fisher-Yates), so only the seeds that are actually
+    consumed are ever shuffled. Seeds are returned as (h, w) tuples in the level 0 frame. Seeds are
+    read once per candidate tile so only __init__ is type checked.
+
+    Attributes:
+        factor (float): Scale factor from mask pixels to level 0 coordinates.
+        chunk_size (int): Number of seeds drawn each time the permutation is extended.
+
+    """
+
+    @typechecked
+    def __init__(self,
+                 mask: np.ndarray,
+                 factor: float,
+                 rng: Optional[np.random.Generator] = None,
+                 chunk_size: int = 1024):
+        """
+
+        Args:
+            mask: 2D array, seeds are drawn from its non-zero pixels.
+            factor: Scale factor from mask pixels to level 0 coordinates.
+            rng: Random generator to draw the permutation with. A fresh one is used if None.
+            chunk_size: Number of seeds drawn each time the permutation is extended.
+        """
+        assert mask.ndim == 2, 'Mask must be 2D.'
+        self.factor = factor
+        self.chunk_size = chunk_size
+        self._width = mask.shape[1]
+        self._indices = np.flatnonzero(mask)
+        self._rng = rng if rng is not None else np.random.default_rng()
+        self._drawn = 0
+
+    def __len__(self):
+        return self._indices.size
+
+    def __getitem__(self, i: int) -> Tuple[int, int]:
+        """
+        Get the ith seed of the random permutation.
+        Args:
+            i: index
+
+        Returns:
+            (h, w) in the level 0 frame.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Seed index out of range.')
+        if i >= self._drawn:
+            self._draw(i + 1 - self._drawn)
+        index = self._indices[i]
+        return int((index // self._width) * self.factor), int((index % self._width) * self.factor)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, start: int, stop: int) -> np.ndarray:
+        """
+        Get seeds start to stop of the permutation as an array.
+        Args:
+            start: index of the first seed
+            stop: index after the last seed, clipped to the number of seeds
+
+        Returns:
+            int64 array of shape (n, 2) holding (h, w) in the level 0 frame.
+        """
+        stop = min(stop, len(self))
+        start = min(start, stop)
+        if stop > self._drawn:
+            self._draw(stop - self._drawn)
+        index = self._indices[start:stop]
+        coordinates = np.empty((stop - start, 2), dtype=np.int64)
+        coordinates[:, 0] = (index // self._width) * self.factor
+        coordinates[:, 1] = (index % self._width) * self.factor
+        return coordinates
+
+    def _draw(self, n: int):
+        """Extend the shuffled prefix of the permutation by at least n seeds (whole chunks)."""
+        n = max(n, self.chunk_size)
+        start = self._drawn
+        stop = min(start + n, len(self))
+        # Swap targets only depend on the position, so they can be drawn in one call.
+        targets = self._rng.integers(np.arange(start, stop), len(self))
+        indices = self._indices
+        for i, j in zip(range(start, stop), targets.tolist()):
+            indices[i], indices[j] = indices[j], indices[i]
+        self._drawn = stop
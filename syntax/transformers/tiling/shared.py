@@ -0,0 +1,86 @@
+import numpy as np
+from syntax._utils.typecheck import typechecked
+from typing import Optional
+
+# Blocks attached by this process, by name. Kept open so arrays viewing them stay valid, until released.
+_attached = {}
+
+
+def release_attached():
+    """Close the blocks this process attached to, e.g. in a long lived worker once its tasks are done.
+    Arrays still viewing a block keep its memory mapped until they are garbage collected."""
+    while _attached:
+        _close(_attached.popitem()[1])
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # Views of the block still use the mapping, it's released with them.
+
+
+@typechecked
+class SharedTileBuffer(object):
+    """Batch of tiles in a shared memory block, an (N, size, size, 3) uint8 array that worker processes write into.
+
+    The process creating the buffer owns the block and must unlink it, e.g. by using the buffer as a
+    context manager. Pickling only sends the name of the block, other processes attach to it when
+    unpickling, so a buffer can be passed to the tasks of a process pool.
+
+    Attributes:
+        name (str): Name of the shared memory block.
+        shape (tuple): (N, size, size, 3).
+        array (np.ndarray): The tiles, a view of the block.
+
+    """
+
+    def __init__(self, num_tiles: int, size: int, name: Optional[str] = None):
+        """
+
+        Args:
+            num_tiles: Number of tiles N.
+            size: Tile size.
+            name: Name of an existing block to attach to, a new block is created if None.
+        """
+        from multiprocessing import shared_memory  # Python 3.8+, only needed once a buffer is used.
+        self.shape = (num_tiles, size, size, 3)
+        self._owner = name is None
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(self.shape)), 1))
+        elif name in _attached:
+            self._shm = _attached[name]
+        else:
+            self._shm = _attached[name] = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape}
+
+    def __setstate__(self, state):
+        self.__init__(state['shape'][0], state['shape'][1], name=state['name'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the tiles in bytes."""
+        return self.array.nbytes
+
+    def close(self):
+        """Remove the block if this buffer created it, else detach this process from it.
+        Memory is freed once no view of array is left."""
+        self.array = None
+        if self._owner:
+            _close(self._shm)
+            self._shm.unlink()
+        elif _attached.pop(self.name, None) is not None:
+            _close(self._shm)
@@ -0,0 +1,65 @@
+from syntax._utils.typecheck import typechecked
+
+
+class OverlapIndex(object):
+    """Hash grid of accepted square tiles, to reject new tiles overlapping one of them too much.
+
+    Tiles are bucketed by origin in cells the size of a tile, so a tile can only overlap tiles
+    in its own and the 8 neighbouring cells. As accepted tiles overlap each other by at most
+    max_overlap, each cell holds a bounded number of them and a check is O(1) whatever the number
+    of accepted tiles. overlaps and add run once per candidate tile so only __init__ is type checked.
+
+    Attributes:
+        extent (float): Side of the tiles, in the frame of the coordinates (e.g. level 0).
+        max_overlap (float): Maximum fraction of a tile's area that may overlap an accepted tile.
+
+    """
+
+    @typechecked
+    def __init__(self, extent: float, max_overlap: float):
+        """
+
+        Args:
+            extent: Side of the tiles, in the frame of the coordinates (e.g. level 0).
+            max_overlap: Maximum fraction of a tile's area that may overlap an accepted tile, in [0, 1).
+        """
+        assert extent > 0, 'extent must be positive.'
+        assert 0 <= max_overlap < 1, 'max_overlap must be in [0, 1).'
+        self.extent = extent
+        self.max_overlap = max_overlap
+        self._limit = max_overlap * extent * extent
+        self._cells = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def overlaps(self, w: int, h: int) -> bool:
+        """
+        Whether the tile at (w, h) overlaps an accepted tile by more than max_overlap.
+        Args:
+            w: Width coordinate of the tile origin.
+            h: Height coordinate of the tile origin.
+
+        Returns:
+            bool
+        """
+        extent = self.extent
+        cw, ch = int(w // extent), int(h // extent)
+        for i in (cw - 1, cw, cw + 1):
+            for j in (ch - 1, ch, ch + 1):
+                for aw, ah in self._cells.get((i, j), ()):
+                    ow, oh = extent - abs(w - aw), extent - abs(h - ah)
+                    if ow > 0 and oh > 0 and ow * oh > self._limit:
+                        return True
+        return False
+
+    def add(self, w: int, h: int):
+        """
+        Accept the tile at (w, h).
+        Args:
+            w: Width coordinate of the tile origin.
+            h: Height coordinate of the tile origin.
+        """
+        self._cells.setdefault((int(w // self.extent), int(h // self.extent)), []).append((w, h))
+        self._count += 1
@@ -0,0 +1,259 @@
+import os
+import glob
+import json
+import zlib
+import warnings
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from syntax._utils.files import file_lock, save_json_atomic
+from syntax._utils.imports import lazy_import
+from syntax._utils.typecheck import typechecked
+from typing import Any, Optional
+from syntax.slide.slide import Slide
+from syntax.transformers.batch import batch_slide_id
+from syntax.transformers.tiling import parallel
+
+pd = lazy_import('pandas')
+
+STORE_VERSION = 1
+INDEX_NAME = 'index.json'
+LOCK_NAME = 'index.lock'
+
+
+def _load_index(store_dir):
+    path = os.path.join(store_dir, INDEX_NAME)
+    if not os.path.exists(path):
+        return {'version': STORE_VERSION, 'slides': {}}
+    with open(path, 'r') as f:
+        index = json.load(f)
+    assert index['version'] == STORE_VERSION, 'Unsupported tile store version {}.'.format(index['version'])
+    return index
+
+
+def _save_index(store_dir, index):
+    save_json_atomic(os.path.join(store_dir, INDEX_NAME), index, indent=1)
+
+
+def _update_entry(store_dir, ID, entry):
+    """Set the index entry of a slide, reloading the index under the store lock so that concurrent
+    exports of other slides aren't lost."""
+    with file_lock(os.path.join(store_dir, LOCK_NAME)):
+        index = _load_index(store_dir)
+        index['slides'][ID] = entry
+        _save_index(store_dir, index)
+
+
+def _fingerprint(tile_frame):
+    """Checksum of the tiles of a tile_frame, their (w, h, mag, size) columns."""
+    columns = np.stack([np.asarray(tile_frame[c], dtype=np.int64) for c in ['w', 'h', 'mag', 'size']], axis=1)
+    return '{:08x}'.format(zlib.crc32(np.ascontiguousarray(columns).tobytes()))
+
+
+def _chunk_filename(slide_dir, k, compress):
+    return os.path.join(slide_dir, '{:06d}.{}'.format(k, 'npz' if compress else 'npy'))
+
+
+def _export_chunk(records, filename, compress):
+    """Read the tiles of a chunk in a worker and write them to one chunk file, atomically."""
+    try:
+        info = records[0]
+        coordinates = [(int(r['w']), int(r['h'])) for r in records]
+        tiles = np.empty((len(records), int(info['size']), int(info['size']), 3), dtype=np.uint8)
+        parallel._worker_slide.get_tiles(coordinates, int(info['mag']), int(info['size']), out=tiles)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            if compress:
+                np.savez_compressed(f, tiles=tiles)
+            else:
+                np.save(f, tiles)
+        os.replace(tmp_filename, filename)
+        return None
+    except Exception as e:
+        return '{}: {}'.format(type(e).__name__, e)
+
+
+@typechecked
+def export_tiles(slide: Slide,
+                 store_dir: str,
+                 tile_frame: Optional[Any] = None,
+                 chunk_size: int = 1024,
+                 compress: bool = False,
+                 num_workers: Optional[int] = None,
+                 mp_context: Optional[str] = None) -> bool:
+    """
+    Export the tiles of a slide to a chunked tile store, readable with TileStore.
+    Tiles are written in chunks of chunk_size tiles per file, in parallel over a pool of processes
+    each with its own Slide, with the tile_frame saved alongside. Chunks are written atomically, so
+    an interrupted export resumes by only writing the missing chunks, provided the tile_frame is the
+    same (e.g. sampled with a seed), else the export of the slide starts again. Slides are appended to
+    an existing store, also by concurrent processes, keyed by batch_slide_id so that slides of the same
+    name in different directories don't collide. A slide already complete in the store is skipped.
+    Args:
+        slide: slide the tiles come from.
+        store_dir: directory of the store, created if needed.
+        tile_frame: DataFrame or structured array of tiles, defaults to slide.tile_frame. \
+                    All tiles must have the same magnification and size.
+        chunk_size: number of tiles per chunk file.
+        compress: if True chunks are zlib compressed (.npz), else stored raw (.npy) and memory mapped on read.
+        num_workers: number of processes, defaults to the number of CPUs.
+        mp_context: multiprocessing start method, e.g. 'spawn'. Platform default if None.
+
+    Returns:
+        True if all chunks of the slide are in the store, False if some failed or the slide is already \
+        complete in the store with other tiles.
+    """
+    if tile_frame is None:
+        tile_frame = slide.tile_frame
+    os.makedirs(store_dir, exist_ok=True)
+    sizes = np.unique(np.asarray(tile_frame['size']))
+    assert len(sizes) <= 1 and len(np.unique(np.asarray(tile_frame['mag']))) <= 1, \
+        'All tiles must have the same magnification and size.'
+    fingerprint = _fingerprint(tile_frame)
+    ID = batch_slide_id(slide.path)
+    slide_dir = os.path.join(store_dir, ID)
+
+    entry = _load_index(store_dir)['slides'].get(ID)
+    if entry is not None:
+        assert entry['chunk_size'] == chunk_size and entry['compress'] == compress, \
+            'Slide {} is already in the store with a different chunk_size or compression.'.format(ID)
+        if entry['complete']:
+            if entry.get('fingerprint') != fingerprint:
+                warnings.warn('Slide {} is already in the store with other tiles, not exported.'.format(ID))
+                return False
+            return True
+        if entry.get('fingerprint') != fingerprint:
+            # Chunks of an interrupted export of another tile_frame, e.g. sampled without a seed.
+            warnings.warn('Restarting the export of {}, its tile_frame changed since it was interrupted.'.format(ID))
+            for filename in glob.glob(os.path.join(slide_dir, '*.np[yz]')):
+                os.remove(filename)
+
+    os.makedirs(slide_dir, exist_ok=True)
+    if hasattr(tile_frame, 'to_pickle'):
+        tile_frame.reset_index(drop=True).to_pickle(os.path.join(slide_dir, 'tile_frame.pickle'))
+        records = tile_frame.to_dict('records')
+    else:
+        np.save(os.path.join(slide_dir, 'tile_frame.npy'), tile_frame)
+        records = [dict(zip(tile_frame.dtype.names, row.tolist())) for row in tile_frame]
+
+    entry = {'num_tiles': len(records),
+             'tile_size': int(sizes[0]) if len(sizes) else None,
+             'chunk_size': chunk_size,
+             'compress': compress,
+             'fingerprint': fingerprint,
+             'complete': False}
+    _update_entry(store_dir, ID, entry)
+
+    missing = [k for k in range((len(records) + chunk_size - 1) // chunk_size)
+               if not os.path.exists(_chunk_filename(slide_dir, k, compress))]
+    errors = {}
+    if missing:
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=multiprocessing.get_context(mp_context),
+                                 initializer=parallel._init_worker,
+                                 initargs=(slide.path, slide.level0, slide.resample)) as pool:
+            futures = {pool.submit(_export_chunk, records[k * chunk_size:(k + 1) * chunk_size],
+                                   _chunk_filename(slide_dir, k, compress), compress): k for k in missing}
+            for future in as_completed(futures):
+                try:
+                    error = future.result()
+                except BrokenProcessPool:
+                    error = 'Worker died while exporting chunk.'
+                if error is not None:
+                    errors[futures[future]] = error
+
+    if errors:
+        warnings.warn('Failed to export {} of {} chunks of {}, export again to resume. First error: {}'.format(
+            len(errors), len(missing), ID, errors[min(errors)]))
+        return False
+    entry['complete'] = True
+    _update_entry(store_dir, ID, entry)
+    return True
+
+
+@typechecked
+class TileStore(object):
+    """Random access reader of a tile store written by export_tiles.
+
+    Tiles of all complete slides are indexed globally in the order the slides were added. Raw chunks
+    are memory mapped, so many processes can read the same store without loading it, and the most
+    recently used max_open_chunks stay mapped (each holds a file descriptor). Compressed chunks are
+    decompressed whole on access (the last one is kept).
+
+    Attributes:
+        store_dir (str): Directory of the store.
+        slides (list): IDs of the complete slides in the store, see batch_slide_id.
+
+    """
+
+    def __init__(self, store_dir: str, max_open_chunks: int = 64):
+        """
+
+        Args:
+            store_dir: Directory of the store.
+            max_open_chunks: Number of raw chunks kept memory mapped.
+        """
+        assert max_open_chunks > 0, 'max_open_chunks must be positive.'
+        self.store_dir = store_dir
+        self.max_open_chunks = max_open_chunks
+        index = _load_index(store_dir)
+        self._entries = {ID: entry for ID, entry in index['slides'].items() if entry['complete']}
+        self.slides = list(self._entries)
+        self._offsets = np.cumsum([0] + [self._entries[ID]['num_tiles'] for ID in self.slides])
+        self._chunks = OrderedDict()
+        self._last_compressed = (None, None)
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """
+        Get a tile by its global index.
+        Args:
+            i: index
+
+        Returns:
+            uint8 (size, size, 3) array
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Tile index out of range.')
+        s = int(np.searchsorted(self._offsets, i, side='right')) - 1
+        ID = self.slides[s]
+        entry = self._entries[ID]
+        k, j = divmod(i - int(self._offsets[s]), entry['chunk_size'])
+        return self._get_chunk(ID, k)[j]
+
+    @property
+    def tile_frame(self) -> 'pd.DataFrame':
+        """Tile frames of all slides concatenated, row i describes tile i."""
+        frames = []
+        for ID in self.slides:
+            slide_dir = os.path.join(self.store_dir, ID)
+            if os.path.exists(os.path.join(slide_dir, 'tile_frame.pickle')):
+                frames.append(pd.read_pickle(os.path.join(slide_dir, 'tile_frame.pickle')))
+            else:
+                frames.append(pd.DataFrame(np.load(os.path.join(slide_dir, 'tile_frame.npy'))))
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def _get_chunk(self, ID, k):
+        """Memory mapped raw chunk, or the decompressed compressed chunk."""
+        entry = self._entries[ID]
+        filename = _chunk_filename(os.path.join(self.store_dir, ID), k, entry['compress'])
+        if not entry['compress']:
+            if filename in self._chunks:
+                self._chunks.move_to_end(filename)
+            else:
+                self._chunks[filename] = np.load(filename, mmap_mode='r')
+                if len(self._chunks) > self.max_open_chunks:
+                    self._chunks.popitem(last=False)  # Unmapped once no tile returned from it is left.
+            return self._chunks[filename]
+        if self._last_compressed[0] != filename:
+            with np.load(filename) as data:
+                self._last_compressed = (filename, data['tiles'])
+        return self._last_compressed[1]
@@ -1,12 +1,17 @@
 import warnings
-from typeguard import typechecked
+import zlib
+from syntax._utils.typecheck import typechecked
 import numpy as np
-from random import shuffle
-import pandas as pd
 from typing import Optional
-from PIL import ImageDraw
+from PIL import Image, ImageDraw
 from syntax.transformers.base import StaticTransformer
 from syntax.slide import Slide
+from syntax.transformers.tiling.seeds import SeedSampler
+from syntax.transformers.tiling.frame import TileFrameBuilder
+from syntax.transformers.tiling.spatial import OverlapIndex
+
+# RGB colours of tile classes in visualisations, cycled for classes beyond them.
+CLASS_COLOURS = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
 
 @typechecked
 class SimpleTiling(StaticTransformer):
@@ -26,32 +31,54 @@ class SimpleTiling(StaticTransformer):
 
     """
 
+    cached_attributes = ('tile_frame',)
+
     def __init__(self,
                  magnification: int,
                  tile_size: int,
                  max_per_class: int,
-                 annotation_threshold: Optional[float] = None):
+                 annotation_threshold: Optional[float] = None,
+                 tissue_threshold: float = 0.9,
+                 seed: Optional[int] = None,
+                 frame_format: str = 'pandas',
+                 max_overlap: Optional[float] = None):
         """
 
         Args:
             magnification:
             tile_size:
+            annotation_threshold: Minimum fraction of its class in a tile for it to be accepted, \
+                                  for slides with an annotation attribute.
+            tissue_threshold: Minimum fraction of tissue in a tile for it to be accepted.
+            seed: Random seed for tile sampling. Combined with the slide ID so that sampling \
+                  is reproducible per slide. If None sampling is not reproducible.
+            frame_format: 'pandas' for a DataFrame tile_frame or 'numpy' for a structured array.
+            max_overlap: If given, a tile overlapping an accepted tile of the same class by more than this \
+                         fraction of its area is rejected, e.g. 0 for non-overlapping tiles. \
+                         If None tiles may overlap freely.
         """
+        assert frame_format in ['pandas', 'numpy'], 'frame_format must be pandas or numpy.'
+        assert max_overlap is None or 0 <= max_overlap < 1, 'max_overlap must be in [0, 1).'
         self.magnification = magnification
         self.tile_size = tile_size
         self.max_per_class = max_per_class
-        self.anno_threshold = annotation_threshold
-        self.rejected = 0
+        self.annotation_threshold = annotation_threshold
+        self.tissue_threshold = tissue_threshold
+        self.seed = seed
+        self.frame_format = frame_format
+        self.max_overlap = max_overlap
+        self.counts = {'accepted': 0, 'rejected_tissue': 0, 'rejected_annotation': 0, 'rejected_overlap': 0}
 
     def transform(self, slide: Slide, target=None):
         """
-        TODO!
+        Sample tiles and add their coordinates and metadata to the slide as a tile_frame.
+        No slide pixels are read, tiles are read on demand from the tile_frame.
         Args:
             slide:
             target:
 
         Returns:
-
+            slide with tile_frame attribute
         """
         # Check if slide already has patch-frame if it does, then just return it as it is
         if self._check_patch_frame(slide):
@@ -65,51 +92,87 @@ class SimpleTiling(StaticTransformer):
         self._check_annotation(slide)
 
         self.slide = slide
+        self.counts = dict.fromkeys(self.counts, 0)
 
         #  Get classes and approximate coordinates to 'seed' the patch sampling process.
         self._get_classes_and_seeds()
 
         slide.tile_frame = self._sample_patches(self.slide.verbose)
+        if getattr(slide, 'profile', None) is not None:
+            slide.profile.add_counts(type(self).__name__, self.counts)
 
         return slide
 
+    @property
+    def deterministic(self) -> bool:
+        """Sampling is only reproducible, and so cached, with a seed."""
+        return self.seed is not None
+
+    @property
+    def rejected(self) -> int:
+        """Number of patches rejected for the last slide, for tissue, annotation or overlap."""
+        return self.counts['rejected_tissue'] + self.counts['rejected_annotation'] + self.counts['rejected_overlap']
+
     @staticmethod
-    def visualize(slide: Slide, size: int):
+    def visualize(slide: Slide, size: int, alpha: int = 96):
         """
-
+        Thumbnail with the tiles of the tile_frame drawn over it, coloured by class.
         Args:
-            slide:
-            size:
+            slide: slide with a tile_frame.
+            size: maximum side of the thumbnail.
+            alpha: opacity of the tile fill, the outlines are opaque.
 
         Returns:
-
+            PIL image
         """
-        wsi_thumb = slide.get_thumbnail(size=(size, size))
-
-        xy = list(zip(slide.tile_frame.w, slide.tile_frame.h))
-
-        for w, h in xy:
-            w = int(w / pow(2, slide.level_count + 2)) + 1
-            h = int(h / pow(2, slide.level_count + 2)) + 1
-            mask = wsi_thumb.copy()
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.rectangle(((w, h), (w + 20, h + 20)), fill=255)
-            wsi_thumb.paste(mask)
-
-        return wsi_thumb
+        wsi_thumb = slide.get_thumbnail(size=(size, size)).convert('RGBA')
+        tile_frame = slide.tile_frame
+
+        # Tile corners in the thumbnail, from the level 0 extent of each tile.
+        scale = np.asarray(wsi_thumb.size, dtype=float) / np.asarray(slide.dimensions, dtype=float)
+        extent = np.asarray(tile_frame['size'], dtype=float) * slide.level0 / np.asarray(tile_frame['mag'], dtype=float)
+        w0 = np.asarray(tile_frame['w'], dtype=float)
+        h0 = np.asarray(tile_frame['h'], dtype=float)
+        corners = np.stack([w0 * scale[0], h0 * scale[1], (w0 + extent) * scale[0], (h0 + extent) * scale[1]], axis=1)
+        corners = np.round(corners).astype(int)
+        corners[:, 2:] = np.maximum(corners[:, 2:] - 1, corners[:, :2])  # Rectangles include their end pixel.
+        classes = np.asarray(tile_frame['class']).astype(int) % len(CLASS_COLOURS)
+
+        overlay = Image.new('RGBA', wsi_thumb.size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        for (x0, y0, x1, y1), c in zip(corners.tolist(), classes.tolist()):
+            colour = CLASS_COLOURS[c]
+            draw.rectangle((x0, y0, x1, y1), fill=colour + (alpha,), outline=colour + (255,))
+        return Image.alpha_composite(wsi_thumb, overlay).convert('RGB')
 
     def _sample_patches(self, verbose=False):
-        """Sample tile and return in a tile_frame"""
-        frame = pd.DataFrame(data=None, columns=['tile_id', 'w', 'h', 'class', 'mag', 'size', 'parent', 'lvl0'])
-
+        """Sample tile and return in a tile_frame.
+        Only coordinates and metadata are recorded, no pixels are read from the slide. Tiles are read on
+        demand later, e.g. with syntax.transformers.tiling.utils.get_tile_from_info_dict."""
+        builder = TileFrameBuilder(parent=self.slide.ID,
+                                   mag=self.magnification,
+                                   size=self.tile_size,
+                                   lvl0=self.slide.level0,
+                                   capacity=sum(min(self.max_per_class, len(seeds)) for seeds in self.class_seeds))
+
+        extent = self.tile_size * self.slide.level0 / self.magnification  # Tile size in level 0 frame.
         for c in self.class_list:
             index = self.class_list.index(c)
             seeds = self.class_seeds[index]
+            accepted = OverlapIndex(extent, self.max_overlap) if self.max_overlap is not None else None
             count = 0
-            for j, seed in enumerate(seeds):
-                _, info = self._class_c_patch_i(c, j)
+            for j, tissue_fraction in self._candidate_seeds(seeds):
+                if accepted is not None:
+                    h, w = seeds[j]
+                    if accepted.overlaps(w, h):
+                        self.counts['rejected_overlap'] += 1
+                        continue
+                _, info = self._class_c_patch_i(c, j, read_tile=False, tissue_fraction=tissue_fraction)
                 if info is not None:
-                    frame = frame.append(info, ignore_index=1)
+                    builder.add(info['tile_id'], info['w'], info['h'], int(c))
+                    self.counts['accepted'] += 1
+                    if accepted is not None:
+                        accepted.add(info['w'], info['h'])
                 if isinstance(self.max_per_class, int):
                     # If not rejected increment count
                     if info is not None:
@@ -119,28 +182,41 @@ class SimpleTiling(StaticTransformer):
         if verbose:
             print('Rejected {} patches for file {}'.format(self.rejected, self.slide.ID))
 
-        return frame
+        if self.frame_format == 'numpy':
+            return builder.to_records()
+        return builder.to_frame()
+
+    def _candidate_seeds(self, seeds: SeedSampler):
+        """Yield (index, tissue fraction) of seeds whose tile passes the tissue threshold.
+        Seeds are scored in bulk against the tissue mask so rejected ones never reach the slide."""
+        for start in range(0, len(seeds), seeds.chunk_size):
+            coordinates = seeds.take(start, start + seeds.chunk_size)
+            fractions = self.tissue_mask.get_tissue_fractions(coordinates[:, 1], coordinates[:, 0],
+                                                              self.magnification, self.tile_size)
+            for j, fraction in enumerate(fractions.tolist(), start):
+                if fraction < self.tissue_threshold:
+                    self.counts['rejected_tissue'] += 1
+                    continue
+                yield j, fraction
 
     def _get_classes_and_seeds(self):
         """Get classes and approximate coordinates to 'seed' the patch sampling process.
         Builds the objects self.class_list and self.class_seeds."""
 
+        rng = self._get_rng()
+
         # Do class 0 i.e. unannotated first.
         mask = self.tissue_mask.data
-        nonzero = np.nonzero(mask)
         factor = self.slide.level_downsamples[self.tissue_mask.level]
-        N = nonzero[0].size
-        coordinates = [(int(nonzero[0][i] * factor), int(nonzero[1][i] * factor)) for i in range(N)]
-        shuffle(coordinates)
         self.class_list = [0]
-        self.class_seeds = [coordinates]
+        self.class_seeds = [SeedSampler(mask, factor, rng)]
 
         # If no annotation we're done.
         if self.annotation is None:
             return
 
         # Now add other classes.
-        annotation_low_res, factor = self.annotation.get_low_res_numpy(self.xml_reader)
+        annotation_low_res, factor = self.annotation.get_low_res_numpy()
         classes = sorted(list(np.unique(annotation_low_res)))
 
         assert classes[0] == 0
@@ -148,29 +224,41 @@ class SimpleTiling(StaticTransformer):
 
         for c in classes:
             mask = (annotation_low_res == c)
-            nonzero = np.nonzero(mask)
-            N = nonzero[0].size
-            coordinates = [(int(nonzero[0][i] * factor), int(nonzero[1][i] * factor)) for i in range(N)]
-            shuffle(coordinates)
-            self.class_list.append(c)
-            self.class_seeds.append(coordinates)
-            
-    def _class_c_patch_i(self, c, i):
+            self.class_list.append(int(c))
+            self.class_seeds.append(SeedSampler(mask, float(factor), rng))
+
+    def _get_rng(self):
+        """Random generator for seed sampling, seeded by self.seed and the slide ID."""
+        if self.seed is None:
+            return np.random.default_rng()
+        return np.random.default_rng([self.seed, zlib.crc32(self.slide.ID.encode())])
+
+    def _class_c_patch_i(self, c, i, read_tile=True, tissue_fraction=None):
         """
         Try and get the ith patch of class c. If we reject return (None, None).
+        The tissue mask and annotation are checked first, so rejected patches are never read from the slide.
         :param c: class
         :param i: index
+        :param read_tile: if False only the info dict is built and the patch is not read (returned as None).
+        :param tissue_fraction: tissue fraction of the patch if already scored, e.g. by _candidate_seeds.
         :return: (patch, info_dict) or (None, None) if we reject patch.
         """
         idx = self.class_list.index(c)
         h, w = self.class_seeds[idx][i]
-        patch = self.slide.get_tile(w, h, self.magnification, self.tile_size)
 
-        tissue_mask_patch = self.tissue_mask.get_tile(w, h, self.magnification, self.tile_size)
-        if np.sum(tissue_mask_patch) / np.prod(tissue_mask_patch.shape) < 0.9:
-            self.rejected += 1
+        if tissue_fraction is None:
+            tissue_fraction = self.tissue_mask.get_tissue_fraction(w, h, self.magnification, self.tile_size)
+        if tissue_fraction < self.tissue_threshold:
+            self.counts['rejected_tissue'] += 1
             return None, None
 
+        # If annotated check the patch has enough of class c, from the polygons clipped to the patch.
+        if self.annotation is not None:
+            if self.annotation.get_class_fraction(c, w, h, self.magnification, self.tile_size) \
+                    < self.annotation_threshold:
+                self.counts['rejected_annotation'] += 1
+                return None, None
+
         info = {
             'tile_id': i,
             'w': w,
@@ -182,19 +270,7 @@ class SimpleTiling(StaticTransformer):
             'lvl0': self.slide.level0
         }
 
-        # If no annotation we're done.
-        if self.annotation is None:
-            return patch, info
-
-        annotation_patch = self.annotation.get_tile(w, h, self.magnification, self.tile_size)
-        annotation_patch = np.asarray(annotation_patch)
-        print(annotation_patch.shape)
-        pixel_pattern = self.xml_reader.label_to_pixel(c)
-        mask = (annotation_patch == pixel_pattern)
-        if np.sum(mask) / np.prod(mask.shape) < self.anno_threshold:
-            self.rejected += 1
-            return None, None
-
+        patch = self.slide.get_tile(w, h, self.magnification, self.tile_size) if read_tile else None
         return patch, info
 
     def _check_patch_frame(self, slide: Slide):
@@ -213,4 +289,5 @@ class SimpleTiling(StaticTransformer):
             warning_string = "{} slide does not have annotation mask supplied".format(slide.ID)
             warnings.warn(warning_string)
         else:
-            self.annotation = slide.annotation
\ No newline at end of file
+            assert self.annotation_threshold is not None, "annotation_threshold is needed for annotated slides."
+            self.annotation = slide.annotation
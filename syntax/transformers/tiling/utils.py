@@ -1,5 +1,5 @@
 import os
-from typeguard import typechecked
+from syntax._utils.typecheck import typechecked
 from typing import Any
 from syntax.slide.slide import Slide
 
@@ -14,15 +14,16 @@ def get_tile_from_info_dict(slide: Slide, info: Any):
     Returns:
         patch (PIL image)
     """
-    patch = slide.get_tile(info['w'], info['h'], info['mag'], info['size'])
+    patch = slide.get_tile(int(info['w']), int(info['h']), int(info['mag']), int(info['size']))
     return patch
 
 @typechecked
 def save_tiles(slide,  save_dir=os.path.join(os.getcwd(), 'patches')):
     """
-    Save tiles in a tile_frame to disk for visualization.
+    Save tiles in a tile_frame to disk for visualization, one PNG per tile.
+    To build a tile dataset use syntax.transformers.tiling.store.export_tiles instead.
     Args:
-        slide: slide that has tile_frame attribute
+        slide: slide that has tile_frame attribute (DataFrame or structured array)
         save_dir: where to save to
 
     Returns:
@@ -33,7 +34,7 @@ def save_tiles(slide,  save_dir=os.path.join(os.getcwd(), 'patches')):
     num_tiles = tile_frame.shape[0]
     print('Saving hard copies of patches in tile_frame to {}.'.format(save_dir))
     for i in range(num_tiles):
-        info = tile_frame.loc[i]
+        info = tile_frame.iloc[i] if hasattr(tile_frame, 'iloc') else tile_frame[i]
         patch = get_tile_from_info_dict(slide, info)
         filename = os.path.join(save_dir, '{}_class_{}_from_{}.png'.format(info['tile_id'], info['class'], info['parent']))
         patch.save(filename)
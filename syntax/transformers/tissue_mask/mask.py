@@ -1,7 +1,13 @@
 import os
+import json
 import pickle
-from typeguard import typechecked
-from typing import Optional
+import struct
+import numpy as np
+from syntax._utils.typecheck import typechecked
+from typing import Dict, Optional, Tuple
+
+MASK_MAGIC = b'SYNTAXTM'
+MASK_VERSION = 1
 
 @typechecked
 class TissueMask(object):
@@ -31,8 +37,31 @@ class TissueMask(object):
         self.level = level
         self.magnification = magnification
         self.ref_factor = ref_factor
+        self._data = None
+        self._packed = None  # Bit-packed rows of the mask when loaded lazily from disk.
+        self._path = None
+        self.threshold = None  # Threshold the mask was computed with, if known.
+        self.refinement = None
+
+    @property
+    def data(self) -> np.ndarray:
+        """Boolean mask. Unpacked on first access if the mask was loaded from disk."""
+        if self._data is None and self._packed is not None:
+            self._data = np.unpackbits(self._packed, axis=1, count=self._shape[1]).astype(bool)
+        return self._data
+
+    @data.setter
+    def data(self, data: np.ndarray):
+        self._data = data
+        self._packed = None
+        self._path = None
 
-    def get_tile(self, w_ref: int, h_ref: int, magnification, effective_size):
+    @property
+    def shape(self):
+        """Shape of the mask, without unpacking it."""
+        return self._shape if self._data is None and self._packed is not None else self.data.shape
+
+    def get_tile(self, w_ref: int, h_ref: int, magnification, effective_size, refined: bool = True):
         """
         Get tile from tissue mask
         Args:
@@ -41,49 +70,278 @@ class TissueMask(object):
             magnification: Desired magnification.
             effective_size: Desired effective patchsize. \
                             NOTE: The patch returned does not have this size!
+            refined: If the mask has a refinement, return the tile at the refinement magnification, \
+                     with refined cells taking precedence over the upsampled mask.
 
         Returns:
             tile, a numpy array
         """
+        if refined and self.refinement is not None:
+            return self._get_refined_tile(w_ref, h_ref, magnification, effective_size)
         w = int(w_ref * self.ref_factor)
         h = int(h_ref * self.ref_factor)
         tile_size = int(effective_size * self.magnification / magnification)
+        if self._data is None and self._packed is not None:
+            # Only unpack the bytes covering the tile.
+            w_end = min(w + tile_size, self._shape[1])
+            packed = self._packed[h:h + tile_size, w // 8:(w_end + 7) // 8]
+            tile = np.unpackbits(packed, axis=1)[:, w % 8:w % 8 + max(w_end - w, 0)].astype(float)
+            return tile
         tile = self.data[h:h + tile_size, w:w + tile_size].astype(float)
         return tile
 
-    def save(self, ID: str, savedir: str, verbose: Optional[bool] = False):
+    def get_tissue_fraction(self, w_ref: int, h_ref: int, magnification, effective_size,
+                            refined: bool = True) -> float:
         """
-        Pickles the tissue mask
+        Fraction of tissue in a tile, in constant time using the integral image of the mask.
+        Equivalent to the mean of get_tile(w_ref, h_ref, magnification, effective_size).
+        Args:
+            w_ref: Width coordinate in frame of reference slide level 0.
+            h_ref: Height coordinate in frame of reference slide level 0.
+            magnification: Desired magnification.
+            effective_size: Desired effective patchsize.
+            refined: Use the refinement of the mask, if any, for tiles touching refined cells.
+
+        Returns:
+            tissue fraction, 0 if the tile lies outside the mask.
+        """
+        return float(self.get_tissue_fractions(np.asarray([w_ref]), np.asarray([h_ref]),
+                                               magnification, effective_size, refined)[0])
+
+    def get_tissue_fractions(self,
+                             w_ref: np.ndarray,
+                             h_ref: np.ndarray,
+                             magnification,
+                             effective_size,
+                             refined: bool = True) -> np.ndarray:
+        """
+        Vectorized get_tissue_fraction, scores many candidate tiles in one call.
+        With a refinement, only the tiles touching refined cells are rescored from the refined tile.
+        Args:
+            w_ref: Width coordinates in frame of reference slide level 0.
+            h_ref: Height coordinates in frame of reference slide level 0.
+            magnification: Desired magnification.
+            effective_size: Desired effective patchsize.
+            refined: Use the refinement of the mask, if any, for tiles touching refined cells.
+
+        Returns:
+            float array of tissue fractions, 0 where a tile lies outside the mask.
+        """
+        integral = self.integral
+        height, width = integral.shape[0] - 1, integral.shape[1] - 1
+        # A tile always covers at least the mask pixel it starts in.
+        tile_size = max(int(effective_size * self.magnification / magnification), 1)
+        w0 = np.clip((np.asarray(w_ref) * self.ref_factor).astype(np.int64), 0, width)
+        h0 = np.clip((np.asarray(h_ref) * self.ref_factor).astype(np.int64), 0, height)
+        w1 = np.minimum(w0 + tile_size, width)
+        h1 = np.minimum(h0 + tile_size, height)
+        tissue = integral[h1, w1] - integral[h0, w1] - integral[h1, w0] + integral[h0, w0]
+        area = (h1 - h0) * (w1 - w0)
+        fractions = np.zeros(area.shape, dtype=float)
+        np.divide(tissue, area, out=fractions, where=area > 0)
+
+        if refined and self.refinement is not None:
+            # Tiles touching a refined cell, found with the integral image of the refined cells. The refined
+            # tile may overlap one more mask pixel than the tile in the mask, as its origin is not rounded down.
+            cell_size = self.refinement['cell_size']
+            cell_integral = self._cell_integral
+            c0, r0 = w0 // cell_size, h0 // cell_size
+            c1 = np.minimum(-(-(w1 + 1) // cell_size), cell_integral.shape[1] - 1)
+            r1 = np.minimum(-(-(h1 + 1) // cell_size), cell_integral.shape[0] - 1)
+            touching = cell_integral[r1, c1] - cell_integral[r0, c1] - cell_integral[r1, c0] + cell_integral[r0, c0]
+            w_ref, h_ref = np.broadcast_to(w_ref, area.shape), np.broadcast_to(h_ref, area.shape)
+            for i in np.flatnonzero((touching > 0) & (area > 0)).tolist():
+                tile = self._get_refined_tile(int(w_ref[i]), int(h_ref[i]), magnification, effective_size)
+                fractions[i] = tile.mean() if tile.size else 0.0
+        return fractions
+
+    def set_refinement(self, level: int, magnification: float, cell_size: int,
+                       cells: Dict[Tuple[int, int], np.ndarray]):
+        """
+        Add a sparse higher magnification version of some cells of the mask.
+        Args:
+            level: Slide level of the refinement.
+            magnification: Magnification of the refinement, an integer multiple of the mask magnification.
+            cell_size: Side of the cells in mask pixels.
+            cells: Boolean arrays at the refinement magnification keyed by (row, col) of the cell. \
+                   Cells on the right and bottom edges may be cropped to the slide.
+        """
+        rows, cols = -(-self.shape[0] // cell_size), -(-self.shape[1] // cell_size)
+        refined_cells = np.zeros((rows, cols), dtype=bool)
+        for row, col in cells:
+            refined_cells[row, col] = True
+        self._cell_integral = np.pad(refined_cells.astype(np.int32).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        self.refinement = {'level': level,
+                           'magnification': magnification,
+                           'ref_factor': self.ref_factor * magnification / self.magnification,
+                           'factor': int(round(magnification / self.magnification)),
+                           'cell_size': cell_size,
+                           'cells': cells}
+
+    def _get_refined_tile(self, w_ref, h_ref, magnification, effective_size):
+        """Tile at the refinement magnification, the upsampled mask overwritten by the refined cells."""
+        refinement = self.refinement
+        factor = refinement['factor']
+        side = refinement['cell_size'] * factor
+        w = int(w_ref * refinement['ref_factor'])
+        h = int(h_ref * refinement['ref_factor'])
+        tile_size = int(effective_size * refinement['magnification'] / magnification)
+        w_end = min(w + tile_size, self.shape[1] * factor)
+        h_end = min(h + tile_size, self.shape[0] * factor)
+        if w_end <= w or h_end <= h:
+            return np.zeros((max(h_end - h, 0), max(w_end - w, 0)))
+
+        low = self.data[h // factor:(h_end - 1) // factor + 1, w // factor:(w_end - 1) // factor + 1]
+        tile = np.repeat(np.repeat(low, factor, axis=0), factor, axis=1)
+        tile = tile[h % factor:h % factor + h_end - h, w % factor:w % factor + w_end - w].astype(float)
+
+        for row in range(h // side, (h_end - 1) // side + 1):
+            for col in range(w // side, (w_end - 1) // side + 1):
+                cell = refinement['cells'].get((row, col))
+                if cell is None:
+                    continue
+                y0, x0 = max(row * side, h), max(col * side, w)
+                y1, x1 = min(row * side + cell.shape[0], h_end), min(col * side + cell.shape[1], w_end)
+                if y1 > y0 and x1 > x0:
+                    tile[y0 - h:y1 - h, x0 - w:x1 - w] = cell[y0 - row * side:y1 - row * side,
+                                                              x0 - col * side:x1 - col * side]
+        return tile
+
+    @property
+    def integral(self) -> np.ndarray:
+        """
+        Integral image (summed-area table) of the mask, padded with a leading row and column of zeros.
+        Built on first use and rebuilt if data is replaced.
+        """
+        if getattr(self, '_integral_source', None) is not self.data:
+            dtype = np.int32 if self.data.size < np.iinfo(np.int32).max else np.int64
+            integral = np.zeros((self.data.shape[0] + 1, self.data.shape[1] + 1), dtype=dtype)
+            np.cumsum(self.data, axis=0, dtype=dtype, out=integral[1:, 1:])
+            np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+            self._integral = integral
+            self._integral_source = self.data
+        return self._integral
+
+    def __getstate__(self):
+        # The integral image is cheap to rebuild, don't pickle it.
+        state = self.__dict__.copy()
+        state.pop('_integral', None)
+        state.pop('_integral_source', None)
+        if state.get('_path') is not None and state.get('_data') is None:
+            # Lazily loaded, reopen the file instead of copying the mask.
+            state['_packed'] = None
+        return state
+
+    def __setstate__(self, state):
+        if 'data' in state:
+            # Pickled by an older version, data was a plain attribute.
+            state['_data'] = state.pop('data')
+        state.setdefault('_packed', None)
+        state.setdefault('_path', None)
+        state.setdefault('threshold', None)
+        state.setdefault('refinement', None)
+        self.__dict__.update(state)
+        if self._path is not None and self._data is None:
+            self._packed, self._shape = self._open_packed(self._path)
+
+    def save(self, ID: str, savedir: str, verbose: Optional[bool] = False) -> str:
+        """
+        Saves the tissue mask bit-packed, with its level, magnification and reference factor.
+        The file is a short header followed by the packed rows, so it can be memory mapped by load,
+        then the packed refined cells if the mask has a refinement.
         Args:
             ID: Name of the reference slide for which tissue mask has been computed
             savedir: Directory to save the mask
-            verbose: Verbosity parameter 
+            verbose: Verbosity parameter
 
         Returns:
-
+            path of the saved mask
         """
         os.makedirs(savedir, exist_ok=True)
-        filename = os.path.join(savedir, ID + '_TissueMask.pickle')
+        filename = os.path.join(savedir, ID + '_TissueMask.tm')
         if verbose:
-            print('Pickling TissueMask to {}'.format(filename))
-        pickling_on = open(filename, 'wb')
-        pickle.dump(self, pickling_on)
-        pickling_on.close()
+            print('Saving TissueMask to {}'.format(filename))
+        packed = self._packed if self._data is None and self._packed is not None else np.packbits(self.data, axis=1)
+        header = {'version': MASK_VERSION,
+                  'level': self.level,
+                  'magnification': self.magnification,
+                  'ref_factor': self.ref_factor,
+                  'shape': list(self.shape),
+                  'threshold': None if self.threshold is None else float(self.threshold)}
+        cells = []
+        if self.refinement is not None:
+            keys = sorted(self.refinement['cells'])
+            cells = [np.packbits(self.refinement['cells'][key], axis=1) for key in keys]
+            offsets = np.cumsum([0] + [cell.nbytes for cell in cells]).tolist()
+            header['refinement'] = {
+                'level': self.refinement['level'],
+                'magnification': self.refinement['magnification'],
+                'cell_size': self.refinement['cell_size'],
+                # (row, col, height, width, offset after the packed rows) of each cell.
+                'cells': [[row, col] + list(self.refinement['cells'][(row, col)].shape) + [offset]
+                          for (row, col), offset in zip(keys, offsets)]}
+        header = json.dumps(header).encode()
+        offset = len(MASK_MAGIC) + 4 + len(header)
+        padding = -offset % 64  # Align the packed rows.
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(MASK_MAGIC)
+            f.write(struct.pack('<I', len(header) + padding))
+            f.write(header + b' ' * padding)
+            f.write(np.ascontiguousarray(packed).tobytes())
+            for cell in cells:
+                f.write(cell.tobytes())
+        os.replace(filename + '.tmp', filename)
+        return filename
 
-    def load(self, path: str):
+    @classmethod
+    def load(cls, path: str):
         """
-        Loads previously computed tissue mask
+        Loads previously saved tissue mask. The mask is memory mapped and only unpacked when needed,
+        so many processes can read tiles of one mask without copies. Pickled masks of older versions
+        are loaded too.
         Args:
             path: path to saved tissue mask
 
         Returns:
-
+            TissueMask
         """
-        pickling_off = open(path, 'rb')
-        tm = pickle.load(pickling_off)
-        self.level = tm.level
-        self.magnification = tm.magnification
-        self.ref_factor = tm.ref_factor
-        self.data = tm.data
-        pickling_off.close()
+        with open(path, 'rb') as f:
+            magic = f.read(len(MASK_MAGIC))
+        if magic != MASK_MAGIC:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        header = cls._read_header(path)
+        tm = cls(header['level'], header['magnification'], header['ref_factor'])
+        tm._path = path
+        tm._packed, tm._shape = cls._open_packed(path)
+        tm.threshold = header.get('threshold')
+        refinement = header.get('refinement')
+        if refinement is not None:
+            # Refined cells are few and small, read them eagerly.
+            start = header['offset'] + tm._packed.nbytes
+            buffer = np.fromfile(path, dtype=np.uint8, offset=start)
+            cells = {}
+            for row, col, height, width, offset in refinement['cells']:
+                packed = buffer[offset:offset + height * ((width + 7) // 8)].reshape(height, -1)
+                cells[(row, col)] = np.unpackbits(packed, axis=1, count=width).astype(bool)
+            tm.set_refinement(refinement['level'], refinement['magnification'], refinement['cell_size'], cells)
+        return tm
+
+    @staticmethod
+    def _read_header(path):
+        with open(path, 'rb') as f:
+            f.seek(len(MASK_MAGIC))
+            header_length = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(header_length).decode())
+        assert header['version'] == MASK_VERSION, 'Unsupported TissueMask version {}.'.format(header['version'])
+        header['offset'] = len(MASK_MAGIC) + 4 + header_length
+        return header
 
+    @staticmethod
+    def _open_packed(path):
+        """Memory map the packed rows of a saved mask. Returns (packed, shape)."""
+        header = TissueMask._read_header(path)
+        height, width = header['shape']
+        packed = np.memmap(path, dtype=np.uint8, mode='r', offset=header['offset'],
+                           shape=(height, (width + 7) // 8))
+        return packed, (height, width)
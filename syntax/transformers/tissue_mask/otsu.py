@@ -1,16 +1,20 @@
 import warnings
-from typeguard import typechecked
-from skimage import filters, color
-from skimage.morphology import opening, closing
+from syntax._utils.typecheck import typechecked
 import numpy as np
-from skimage.morphology import disk
-from skimage.morphology import dilation
 from PIL import Image
+from typing import Optional
+from syntax._utils.imports import lazy_import
 from syntax.transformers.tissue_mask.mask import TissueMask
 from syntax.transformers.base import StaticTransformer
 from syntax.slide import Slide
 from syntax.slide.utils import get_level
 
+# scikit-image and scipy are only loaded when a mask is computed.
+filters = lazy_import('skimage.filters')
+color = lazy_import('skimage.color')
+morphology = lazy_import('skimage.morphology')
+ndimage = lazy_import('scipy.ndimage')
+
 @typechecked
 class OtsuTissueMask(StaticTransformer):
     """The summary line for a class docstring should fit on one line.
@@ -29,8 +33,37 @@ class OtsuTissueMask(StaticTransformer):
 
     """
 
-    def __init__(self):
-        pass
+    # Radius of disk for morphological operations.
+    disk_radius = 10
+
+    cached_attributes = ('tissue_mask',)
+
+    def __init__(self,
+                 max_memory: Optional[int] = None,
+                 backend: str = 'skimage',
+                 refine_magnification: Optional[float] = None,
+                 refine_cell_size: int = 8,
+                 refine_radius: int = 2):
+        """
+
+        Args:
+            max_memory: If given the mask is computed out-of-core in chunks using roughly this many bytes \
+                        of working memory (the output mask itself is one byte per pixel). \
+                        If None the whole level is read at once.
+            backend: 'skimage' for the reference implementation or 'fast', which computes the saturation \
+                     threshold from uint8 max/min values and the morphology from distance transforms. \
+                     Both give the same mask.
+            refine_magnification: If given, cells of the mask along tissue borders are recomputed at the \
+                                  pyramid level closest to this magnification, with the same threshold.
+            refine_cell_size: Side in mask pixels of the cells that are refined.
+            refine_radius: Radius of the disk for morphological operations on refined cells.
+        """
+        assert backend in ['skimage', 'fast'], 'backend must be skimage or fast.'
+        self.max_memory = max_memory
+        self.backend = backend
+        self.refine_magnification = refine_magnification
+        self.refine_cell_size = refine_cell_size
+        self.refine_radius = refine_radius
 
     def transform(self, slide: Slide, target=None):
         """
@@ -54,12 +87,21 @@ class OtsuTissueMask(StaticTransformer):
         # Initialise tissue mask with slide
         slide.tissue_mask = TissueMask(level, magnification, ref_factor)
 
-        slide.tissue_mask.data = self._generate_tissue_mask_basic(slide, level)
+        if self.max_memory is None:
+            mask, threshold = self._generate_tissue_mask_basic(slide, level, self.backend, return_threshold=True)
+        else:
+            mask, threshold = self._generate_tissue_mask_chunked(slide, level, self.max_memory, self.backend,
+                                                                 return_threshold=True)
+        slide.tissue_mask.data = mask
+        slide.tissue_mask.threshold = threshold
+
+        if self.refine_magnification is not None:
+            self._refine_tissue_mask(slide, slide.tissue_mask)
 
         return slide
 
     @staticmethod
-    def _generate_tissue_mask_basic(slide, level):
+    def _generate_tissue_mask_basic(slide, level, backend='skimage', return_threshold=False):
         """
         Generate a tissue mask.
         This is achieved by Otsu thresholding on the saturation channel \
@@ -67,6 +109,8 @@ class OtsuTissueMask(StaticTransformer):
         Args:
             slide:
             level:
+            backend: 'skimage' or 'fast'
+            return_threshold: if True also return the saturation threshold.
 
         Returns:
 
@@ -77,19 +121,218 @@ class OtsuTissueMask(StaticTransformer):
             low_res_numpy = np.asarray(low_res)  # Convert to numpy array.
         else:
             low_res_numpy = slide.read_region(location=(0, 0), level=level, size=slide.level_dimensions[level])
-        low_res_numpy_hsv = color.convert_colorspace(low_res_numpy, 'RGB', 'HSV')  # Convert to Hue-Saturation-Value.
-        saturation = low_res_numpy_hsv[:, :, 1]  # Get saturation channel.
-        threshold = filters.threshold_otsu(saturation)  # Otsu threshold.
-        mask = (saturation > threshold)  # Tissue is 'high saturation' region.
-
-        # Morphological operations
-        disk_radius = 10  # radius of disk for morphological operations.
-        disk_object = disk(disk_radius)
-        mask = closing(mask, disk_object)  # remove 'pepper'.
-        mask = opening(mask, disk_object)  # remove 'salt'.
+        return OtsuTissueMask._mask_from_rgb(low_res_numpy, backend, return_threshold)
+
+    @staticmethod
+    def _mask_from_rgb(rgb, backend='skimage', return_threshold=False):
+        """
+        Tissue mask of an RGB uint8 array.
+        Args:
+            rgb:
+            backend: 'skimage' or 'fast'
+            return_threshold: if True also return the saturation threshold.
+
+        Returns:
+
+        """
+        if backend == 'fast':
+            pairs = OtsuTissueMask._saturation_pairs(rgb)
+            threshold = OtsuTissueMask._otsu_from_pair_counts(np.bincount(pairs.ravel(), minlength=256 * 256))
+            mask = OtsuTissueMask._threshold(rgb, threshold, backend)
+        else:
+            low_res_numpy_hsv = color.convert_colorspace(rgb, 'RGB', 'HSV')  # Convert to Hue-Saturation-Value.
+            saturation = low_res_numpy_hsv[:, :, 1]  # Get saturation channel.
+            threshold = filters.threshold_otsu(saturation)  # Otsu threshold.
+            mask = (saturation > threshold)  # Tissue is 'high saturation' region.
+
+        mask = OtsuTissueMask._morphology(mask, backend)
         assert mask.dtype == bool, 'Mask not Boolean'
+        if return_threshold:
+            return mask, threshold
         return mask
 
+    @staticmethod
+    def _threshold(rgb, threshold, backend='skimage'):
+        """Pixels of an RGB uint8 array with saturation above threshold."""
+        if backend == 'fast':
+            # Saturation only depends on the (max, min) pair, threshold the 65536 possible pairs once.
+            lookup = OtsuTissueMask._pair_saturation() > threshold
+            return lookup[OtsuTissueMask._saturation_pairs(rgb)]
+        saturation = color.convert_colorspace(rgb, 'RGB', 'HSV')[:, :, 1]
+        return saturation > threshold
+
+    @staticmethod
+    def _morphology(mask, backend='skimage', radius=None):
+        """Closing then opening with a disk, to remove 'pepper' then 'salt'."""
+        radius = OtsuTissueMask.disk_radius if radius is None else radius
+        if backend == 'fast':
+            mask = OtsuTissueMask._erode_disk(OtsuTissueMask._dilate_disk(mask, radius), radius)
+            mask = OtsuTissueMask._dilate_disk(OtsuTissueMask._erode_disk(mask, radius), radius)
+            return mask
+        disk_object = morphology.disk(radius)
+        mask = morphology.closing(mask, disk_object)  # remove 'pepper'.
+        mask = morphology.opening(mask, disk_object)  # remove 'salt'.
+        return mask
+
+    @staticmethod
+    def _dilate_disk(mask, radius):
+        """
+        Binary dilation by disk(radius) from a Euclidean distance transform: a pixel is set if a set pixel
+        lies within radius. Borders are reflected as in skimage's dilation.
+        """
+        if not mask.any():
+            return mask.copy()
+        padded = np.pad(mask, radius, mode='symmetric')
+        distance = ndimage.distance_transform_edt(~padded)
+        # Squared distances are integers, the margin only absorbs rounding of the square root.
+        return distance[radius:-radius, radius:-radius] <= radius + 1e-6
+
+    @staticmethod
+    def _erode_disk(mask, radius):
+        """Binary erosion by disk(radius), the complement of the dilation of the complement."""
+        return ~OtsuTissueMask._dilate_disk(~mask, radius)
+
+    @staticmethod
+    def _saturation_pairs(rgb):
+        """Index max * 256 + min of the RGB values of each pixel, which determines its saturation."""
+        return rgb.max(axis=2).astype(np.uint16) * 256 + rgb.min(axis=2)
+
+    @staticmethod
+    def _pair_saturation():
+        """Saturation of every (max, min) pair, computed as in skimage's rgb2hsv."""
+        pairs = np.arange(256 * 256)
+        value_max = (pairs // 256) / 255.0
+        value_min = (pairs % 256) / 255.0
+        delta = value_max - value_min
+        with np.errstate(invalid='ignore', divide='ignore'):
+            saturation = delta / value_max
+        saturation[delta == 0.0] = 0.0
+        return saturation
+
+    @staticmethod
+    def _generate_tissue_mask_chunked(slide, level, max_memory, backend='skimage', return_threshold=False):
+        """
+        Generate the same tissue mask as _generate_tissue_mask_basic, reading the level in chunks.
+        A first pass counts the (max, min) RGB value pairs of every pixel, which determine its
+        saturation, giving the exact global saturation histogram and so the same Otsu threshold.
+        A second pass thresholds each chunk and applies the morphology on it with a halo wide
+        enough (4 disk radii) for the result not to depend on the chunk borders. Identical to the
+        single-shot mask when the level downsample is an integer.
+        Args:
+            slide:
+            level:
+            max_memory: Approximate working memory in bytes.
+            backend: 'skimage' or 'fast'
+            return_threshold: if True also return the saturation threshold.
+
+        Returns:
+
+        """
+        width, height = slide.level_dimensions[level]
+        halo = 4 * OtsuTissueMask.disk_radius  # closing and opening are two dilations and two erosions.
+        # Roughly 64 bytes per pixel for RGBA, float64 HSV and the intermediate masks.
+        chunk_size = max(int(np.sqrt(max_memory / 64)) - 2 * halo, 64)
+
+        # First pass, counts of (max, min) RGB pairs.
+        pair_counts = np.zeros(256 * 256, dtype=np.int64)
+        for x, y, w, h in OtsuTissueMask._chunks(width, height, chunk_size):
+            rgb = OtsuTissueMask._read_rgb(slide, level, x, y, w, h)
+            pair_counts += np.bincount(OtsuTissueMask._saturation_pairs(rgb).ravel(), minlength=256 * 256)
+        threshold = OtsuTissueMask._otsu_from_pair_counts(pair_counts)
+
+        # Second pass, threshold and morphology per chunk with a halo.
+        mask = np.zeros((height, width), dtype=bool)
+        for x, y, w, h in OtsuTissueMask._chunks(width, height, chunk_size):
+            x0, y0 = max(x - halo, 0), max(y - halo, 0)
+            x1, y1 = min(x + w + halo, width), min(y + h + halo, height)
+            rgb = OtsuTissueMask._read_rgb(slide, level, x0, y0, x1 - x0, y1 - y0)
+            chunk_mask = OtsuTissueMask._threshold(rgb, threshold, backend)
+            chunk_mask = OtsuTissueMask._morphology(chunk_mask, backend)
+            mask[y:y + h, x:x + w] = chunk_mask[y - y0:y - y0 + h, x - x0:x - x0 + w]
+        if return_threshold:
+            return mask, threshold
+        return mask
+
+    def _refine_tissue_mask(self, slide, tissue_mask):
+        """
+        Recompute the cells of the mask along tissue borders at a higher magnification.
+        Cells of refine_cell_size mask pixels containing a border pixel are read at the refinement level,
+        thresholded with the threshold of the whole mask and cleaned with a small closing and opening.
+        Args:
+            slide:
+            tissue_mask: mask with data and threshold, the refinement is added to it.
+        """
+        level = get_level(magnification=self.refine_magnification,
+                          magnification_list=slide.magnifications,
+                          threshold=self.refine_magnification)
+        assert level < tissue_mask.level, 'Refinement magnification must be higher than the mask magnification.'
+        factor = int(round(slide.level_downsamples[tissue_mask.level] / slide.level_downsamples[level]))
+        width, height = slide.level_dimensions[level]
+        cell_size = self.refine_cell_size
+        halo = 4 * self.refine_radius
+
+        # Border pixels are set pixels with an unset neighbour and vice versa.
+        mask = tissue_mask.data
+        border = self._dilate_disk(mask, 1) & ~self._erode_disk(mask, 1)
+        rows, cols = -(-mask.shape[0] // cell_size), -(-mask.shape[1] // cell_size)
+        padded = np.zeros((rows * cell_size, cols * cell_size), dtype=bool)
+        padded[:mask.shape[0], :mask.shape[1]] = border
+        border_cells = padded.reshape(rows, cell_size, cols, cell_size).any(axis=(1, 3))
+
+        cells = {}
+        side = cell_size * factor  # Cell side at the refinement level.
+        for row, col in np.argwhere(border_cells).tolist():
+            x, y = col * side, row * side
+            w, h = min(side, width - x), min(side, height - y)
+            if w <= 0 or h <= 0:
+                continue
+            x0, y0 = max(x - halo, 0), max(y - halo, 0)
+            x1, y1 = min(x + w + halo, width), min(y + h + halo, height)
+            rgb = self._read_rgb(slide, level, x0, y0, x1 - x0, y1 - y0)
+            cell = self._threshold(rgb, tissue_mask.threshold, self.backend)
+            cell = self._morphology(cell, self.backend, self.refine_radius)
+            cells[(row, col)] = cell[y - y0:y - y0 + h, x - x0:x - x0 + w]
+
+        tissue_mask.set_refinement(int(level), float(slide.magnifications[level]), cell_size, cells)
+
+    @staticmethod
+    def _chunks(width, height, chunk_size):
+        """Yield (x, y, w, h) chunks covering a level."""
+        for y in range(0, height, chunk_size):
+            for x in range(0, width, chunk_size):
+                yield x, y, min(chunk_size, width - x), min(chunk_size, height - y)
+
+    @staticmethod
+    def _read_rgb(slide, level, x, y, w, h):
+        """Read a region given in level coordinates as an RGB uint8 array."""
+        downsample = slide.level_downsamples[level]
+        location = (int(round(x * downsample)), int(round(y * downsample)))
+        if not hasattr(slide, 'jp2'):
+            return np.asarray(slide.read_region(location=location, level=level, size=(w, h)).convert('RGB'))
+        return slide.read_region(location=location, level=level, size=(w, h))
+
+    @staticmethod
+    def _otsu_from_pair_counts(pair_counts):
+        """
+        Otsu threshold of the saturation of an image, given the counts of its (max, min) RGB pairs.
+        Saturation is computed as in skimage's rgb2hsv so the histogram matches the one of the full image.
+        """
+        present = np.flatnonzero(pair_counts)
+        saturation = OtsuTissueMask._pair_saturation()[present]
+        if saturation.min() == saturation.max():
+            return saturation[0]
+        counts, bin_edges = np.histogram(saturation, bins=256, range=(saturation.min(), saturation.max()),
+                                         weights=pair_counts[present])
+        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2.0
+        # Otsu on the histogram as skimage's threshold_otsu computes it, whose hist argument needs
+        # scikit-image>=0.19. The first and last bins are never empty so no class weight is 0.
+        weight1 = np.cumsum(counts)
+        weight2 = np.cumsum(counts[::-1])[::-1]
+        mean1 = np.cumsum(counts * bin_centers) / weight1
+        mean2 = (np.cumsum((counts * bin_centers)[::-1]) / weight2[::-1])[::-1]
+        variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+        return bin_centers[np.argmax(variance12)]
+
     @staticmethod
     def visualize(slide: Slide, size: int):
         """
@@ -102,14 +345,15 @@ class OtsuTissueMask(StaticTransformer):
 
         """
         tissue_mask = slide.tissue_mask
-        tm = Image.fromarray(tissue_mask.data.astype(float))
-        tm.thumbnail(size=(size, size))
-        tm = np.asarray(tm)
+        wsi_thumb = np.asarray(slide.get_thumbnail(size=(size, size))).copy()  # Copy to avoid read-only issue.
 
-        dilated = dilation(tm, disk(10))
-        contour = np.logical_xor(dilated, tm).astype(np.bool)
+        # Mask at the size of the thumbnail, which can differ by a pixel from the mask's own thumbnail.
+        tm = Image.fromarray(tissue_mask.data.astype(np.uint8) * 255)
+        tm = np.asarray(tm.resize((wsi_thumb.shape[1], wsi_thumb.shape[0]), Image.NEAREST)) > 0
+
+        dilated = morphology.dilation(tm, morphology.disk(10))
+        contour = np.logical_xor(dilated, tm)
 
-        wsi_thumb = np.asarray(slide.get_thumbnail(size=(size, size))).copy()  # Copy to avoid read-only issue.
         wsi_thumb[contour] = 0
 
         pil = Image.fromarray(wsi_thumb)
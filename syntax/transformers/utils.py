@@ -1,20 +1,23 @@
-from typeguard import typechecked
+from syntax._utils.imports import lazy_import
+from syntax._utils.typecheck import typechecked
 from typing import List, Any, Optional
 import numpy as np
-import matplotlib.pyplot as plt
 from syntax.slide.slide import Slide
 
+plt = lazy_import('matplotlib.pyplot')
+
 @typechecked
 def visualize_pipeline_results(slide: Slide,
                                transformer_list: List[Any],
                                title_list: Optional[List[str]] = None,
                                size: int = 1000):
     """
-    Visualise results of the pipeline
+    Visualise results of the pipeline, the slide thumbnail and the visualisation of each transformer.
     Args:
         slide:
         transformer_list:
-        size:
+        title_list:
+        size: maximum side of the thumbnails, computed once per slide and size.
 
     Returns:
 
@@ -25,11 +28,8 @@ def visualize_pipeline_results(slide: Slide,
     if title_list:
         title_list = ['Slide'] + title_list
 
-    pil = slide.get_thumbnail(size=(size, size))
     for i, ax in enumerate(axes):
-        if i > 0:
-            pil2 = transformer_list[i-1].visualize(slide, size)
-            pil.paste(pil2)
+        pil = slide.get_thumbnail(size=(size, size)) if i == 0 else transformer_list[i-1].visualize(slide, size)
         ax.axis("off")
         ax.imshow(np.asarray(pil), cmap="gray")
         if title_list: